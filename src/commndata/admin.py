@@ -1,13 +1,30 @@
+import hashlib
 from itertools import filterfalse
 from django.contrib import admin
+from django.contrib.admin.options import csrf_protect_m
 from django.contrib.admin.utils import flatten
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 import datetime
 from django.contrib.admin.widgets import AdminDateWidget, AdminSplitDateTime, RelatedFieldWidgetWrapper
-
-from commndata.forms import SuperUserAuthenticationForm, ActiveUserAuthenticationForm
+from django.db import router, transaction
+from django.db.models import Q
+from django.urls import path
+from django.utils.functional import Promise, lazy
+from django.utils.translation import get_language
+
+from commndata import search
+from commndata.cache import PERMISSIONS_GENERATION_KEY, get_cache, get_codecategories, get_generation, get_or_set_model_data, \
+    get_timeout
+from commndata.forms import LockedCheckFormMixin, SuperUserAuthenticationForm, ActiveUserAuthenticationForm
+from commndata.importing import ImportCounter
 from commndata.models import BaseTable
+from commndata.transactions import atomic_with_retry
+from commndata.views import AutocompleteIndex, CachedAutocompleteJsonView
+from commndata.widgets import CachedAutocompleteSelect
+
+LOADED_VALUES_SESSION_KEY = 'commndata:loaded_values'
+LOADED_VALUES_SESSION_SIZE = 20
 
 def disable_fields(form, disabled_fields):
     def set_disable(item):
@@ -34,7 +51,66 @@ def disable_fields(form, disabled_fields):
     for widget in [form.base_fields[f].widget for f in form.base_fields if f in disabled_fields]:
         disable_field(widget)
 
-class SuperUserOnlyAdminSite(admin.AdminSite):
+class CachedAppListAdminSiteMixin():
+    """
+    Cache the user's permissions and the app list(the index page and the nav sidebar) of an AdminSite.
+    The app list is shared by the users with the same permissions, and both are discarded
+    when groups or permissions are changed(see commndata.signals). Like the cached codes, this needs a cache
+    shared by all processes(settings.COMMNDATA_CACHE), see commndata.checks.
+    """
+    def load_permissions(self, request) -> None:
+        """
+        Load the user's permissions from the cache into ModelBackend's permission cache of request.user.
+        """
+        user = request.user
+        if not user.is_active or hasattr(request, '_commndata_permissions_fingerprint'):
+            return
+
+        cache = get_cache()
+        key = 'commndata:permissions:%s:%s:%s' % (get_generation(PERMISSIONS_GENERATION_KEY), user.pk, user.is_superuser)
+        cached = cache.get(key)
+        if cached is None:
+            permissions = user.get_all_permissions()
+            fingerprint = hashlib.sha256(repr((user.is_superuser, sorted(permissions))).encode('utf-8')).hexdigest()
+            cached = (permissions, fingerprint)
+            cache.set(key, cached, get_timeout())
+        if not hasattr(user, '_perm_cache'):
+            user._perm_cache = cached[0]
+        request._commndata_permissions_fingerprint = cached[1]
+
+    def _build_app_dict(self, request, label=None):
+        """
+        override of the AdminSite
+        """
+        self.load_permissions(request)
+        fingerprint = getattr(request, '_commndata_permissions_fingerprint', None)
+        if fingerprint is None:
+            return super(CachedAppListAdminSiteMixin, self)._build_app_dict(request, label)
+
+        app_dicts = getattr(request, '_commndata_app_dicts', None)
+        if app_dicts is None:
+            app_dicts = request._commndata_app_dicts = {}
+        if label not in app_dicts:
+            cache = get_cache()
+            key = 'commndata:applist:%s:%s:%s:%s:%s' % (
+                get_generation(PERMISSIONS_GENERATION_KEY), self.name, get_language(), label, fingerprint)
+            app_dict = cache.get(key)
+            if app_dict is None:
+                app_dict = super(CachedAppListAdminSiteMixin, self)._build_app_dict(request, label)
+                # Lazy names can not be pickled, so translate them in the language of the key.
+                app_dict = self.resolve_lazy_names(app_dict)
+                cache.set(key, app_dict, get_timeout())
+            app_dicts[label] = app_dict
+        return app_dicts[label]
+
+    def resolve_lazy_names(self, value):
+        if isinstance(value, dict):
+            return {k: self.resolve_lazy_names(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve_lazy_names(v) for v in value]
+        return str(value) if isinstance(value, Promise) else value
+
+class SuperUserOnlyAdminSite(CachedAppListAdminSiteMixin, admin.AdminSite):
     enable_nav_sidebar = True
     _empty_value_display = '-'
 
@@ -44,9 +120,10 @@ class SuperUserOnlyAdminSite(admin.AdminSite):
         """
         Give permission to superuser only.
         """
+        self.load_permissions(request)
         return request.user.is_superuser
 
-class ActiveUserAdminSite(admin.AdminSite):
+class ActiveUserAdminSite(CachedAppListAdminSiteMixin, admin.AdminSite):
     enable_nav_sidebar = True
     _empty_value_display = '-'
     
@@ -56,6 +133,7 @@ class ActiveUserAdminSite(admin.AdminSite):
         """
         Give permission to any active user.
         """
+        self.load_permissions(request)
         return request.user.is_active
 
 class UserAdminMixin():
@@ -88,11 +166,110 @@ class UserAdminMixin():
 
         return form
 
+class CodeCategoryListFilter(admin.SimpleListFilter):
+    """
+    List filter of codecategory, whose options come from the cached code categories instead of a query per view.
+    """
+    title = _('code category')
+    parameter_name = 'codecategory'
+
+    def lookups(self, request, model_admin):
+        return [(str(pk), name) for pk, codecategory, name in get_codecategories()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(codecategory_id=self.value())
+        return queryset
+
 class BaseTableAdminMixin():
     """
     This is intended to be mixed with django.contrib.admin.ModelAdmin, and used to register BaseTable class
     """
     save_on_top = False
+    # Use the autocomplete widget for foreign keys to BaseTable models registered with search_fields.
+    autocomplete_base_tables = True
+
+    def get_urls(self):
+        """
+        override of the ModelAdmin
+        """
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('autocomplete/', self.admin_site.admin_view(self.autocomplete_view), name='%s_%s_autocomplete' % info),
+        ] + super(BaseTableAdminMixin, self).get_urls()
+
+    def autocomplete_view(self, request):
+        return CachedAutocompleteJsonView.as_view(admin_site=self.admin_site)(request)
+
+    def get_autocomplete_index(self, request, to_field_name: str) -> AutocompleteIndex:
+        """
+        The autocomplete results are cached until a record of this model is written.
+        get_queryset() should not depend on the request user, since the index is shared.
+        """
+        return get_or_set_model_data(
+            self.model, 'autocomplete:%s' % to_field_name,
+            lambda: AutocompleteIndex.build(self.get_queryset(request), to_field_name, self.get_search_fields(request))
+        )
+
+    def get_autocomplete_fields(self, request):
+        """
+        override of the ModelAdmin
+        """
+        autocomplete_fields = list(super(BaseTableAdminMixin, self).get_autocomplete_fields(request))
+        if not self.autocomplete_base_tables:
+            return autocomplete_fields
+
+        for field in self.model._meta.get_fields():
+            if not field.many_to_one or not field.concrete or field.name in autocomplete_fields:
+                continue
+            related_admin = self.admin_site._registry.get(field.remote_field.model)
+            if issubclass(field.remote_field.model, BaseTable) and related_admin and related_admin.get_search_fields(request):
+                autocomplete_fields.append(field.name)
+        return autocomplete_fields
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        """
+        override of the ModelAdmin
+        """
+        related_admin = self.admin_site._registry.get(db_field.remote_field.model)
+        if 'widget' not in kwargs and isinstance(related_admin, BaseTableAdminMixin) \
+                and db_field.name in self.get_autocomplete_fields(request):
+            kwargs['widget'] = CachedAutocompleteSelect(db_field, self.admin_site, using=kwargs.get('using'))
+        return super(BaseTableAdminMixin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def has_model_permission(self, request, action: str, check) -> bool:
+        """
+        Model-level(obj=None) permission checks are repeated for every row, link and button of a page,
+        so call check() once per request.
+        """
+        permissions = getattr(request, '_commndata_model_permissions', None)
+        if permissions is None:
+            permissions = request._commndata_model_permissions = {}
+        key = (self.admin_site.name, self.opts.label, action)
+        if key not in permissions:
+            permissions[key] = check()
+        return permissions[key]
+
+    def has_view_permission(self, request, obj=None):
+        if obj is None:
+            return self.has_model_permission(request, 'view',
+                lambda: super(BaseTableAdminMixin, self).has_view_permission(request))
+        return super(BaseTableAdminMixin, self).has_view_permission(request, obj)
+
+    def has_add_permission(self, request):
+        return self.has_model_permission(request, 'add', lambda: super(BaseTableAdminMixin, self).has_add_permission(request))
+
+    def has_change_permission(self, request, obj=None):
+        if obj is None:
+            return self.has_model_permission(request, 'change',
+                lambda: super(BaseTableAdminMixin, self).has_change_permission(request))
+        return super(BaseTableAdminMixin, self).has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        if obj is None:
+            return self.has_model_permission(request, 'delete',
+                lambda: super(BaseTableAdminMixin, self).has_delete_permission(request))
+        return super(BaseTableAdminMixin, self).has_delete_permission(request, obj)
 
     def get_csv_excluded_fields(self) -> list[str]:
         """
@@ -103,15 +280,41 @@ class BaseTableAdminMixin():
     def get_csv_excluded_fields_init_values(self, request) -> dict:
         """
         override CsvImportModelMixin
+        The same values for all rows of the import, so that the inserted records can be counted by created_at.
         """
-        return super(BaseTableAdminMixin, self).get_csv_excluded_fields_init_values(request) | self.model.get_init_values(request.user.username)
+        init_values = getattr(request, '_commndata_csv_init_values', None)
+        if init_values is None:
+            init_values = request._commndata_csv_init_values = self.model.get_init_values(request.user.username)
+        self.get_csv_import_counter(request)
+        return super(BaseTableAdminMixin, self).get_csv_excluded_fields_init_values(request) | init_values
 
     def update_csv_excluded_fields(self, request, row: BaseTable):
         """
         override CsvImportModelMixin
+        The row is compared with the stored record by bulk_update(), and left out if unchanged.
         """
         super(BaseTableAdminMixin, self).update_csv_excluded_fields(request, row)
         row.set_update_values(request.user.username)
+        row.import_counter = self.get_csv_import_counter(request)
+
+    def get_csv_import_counter(self, request) -> ImportCounter:
+        """
+        The counts of the CSV import of request, reported with message_user() once the import is committed.
+        """
+        counter = getattr(request, '_commndata_import_counter', None)
+        if counter is None:
+            counter = request._commndata_import_counter = ImportCounter()
+            # The message is formatted when the response is rendered, after all rows are written.
+            message = lazy(self.get_csv_import_message, str)(request, counter)
+            transaction.on_commit(lambda: self.message_user(request, message), using=router.db_for_write(self.model))
+        return counter
+
+    def get_csv_import_message(self, request, counter: ImportCounter) -> str:
+        init_values = getattr(request, '_commndata_csv_init_values', None)
+        if init_values:
+            counter.inserted = self.model._base_manager.using(router.db_for_write(self.model)) \
+                                   .filter(creator=init_values['creator'], created_at=init_values['created_at']).count()
+        return _('CSV import: %(inserted)d inserted, %(updated)d updated, %(unchanged)d unchanged.') % counter.result()._asdict()
 
     def get_update_fields(self) -> list[str]:
         """
@@ -157,11 +360,79 @@ class BaseTableAdminMixin():
         override of the ModelAdmin
         """
         form = super(BaseTableAdminMixin, self).get_form(request, obj, **kwargs)
+        if not issubclass(form, LockedCheckFormMixin):
+            form = type(form.__name__, (LockedCheckFormMixin, form), {})
         disable_fields(form, self.get_html_readonly_fields(request, obj, **kwargs))
 
         return form
 
+    def get_object(self, request, object_id, from_field=None):
+        """
+        override of the ModelAdmin
+        On save, give the object the values the edit started from, to merge concurrent changes.
+        """
+        obj = super(BaseTableAdminMixin, self).get_object(request, object_id, from_field)
+        if obj is not None and obj.merge_concurrent_changes and request.method == 'POST':
+            key = self.get_loaded_values_key(obj, request.POST.get('version'))
+            obj.loaded_values = request.session.get(LOADED_VALUES_SESSION_KEY, {}).get(key)
+        return obj
+
+    def get_loaded_values_key(self, obj, version) -> str:
+        return '%s:%s:%s' % (obj._meta.label_lower, obj.pk, version)
+
+    def render_change_form(self, request, context, add=False, change=False, form_url='', obj=None):
+        """
+        override of the ModelAdmin
+        Keep the values the edit starts from in the session, to merge concurrent changes on save.
+        """
+        if change and obj is not None and obj.merge_concurrent_changes and request.method == 'GET':
+            loaded_values = request.session.get(LOADED_VALUES_SESSION_KEY, {})
+            key = self.get_loaded_values_key(obj, obj.version)
+            loaded_values.pop(key, None)
+            loaded_values[key] = obj.get_loaded_values()
+            # Keep the latest edits only.
+            request.session[LOADED_VALUES_SESSION_KEY] = dict(list(loaded_values.items())[-LOADED_VALUES_SESSION_SIZE:])
+        return super(BaseTableAdminMixin, self).render_change_form(request, context, add, change, form_url, obj)
+
+    @csrf_protect_m
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        """
+        override of the ModelAdmin
+        Run the request in a transaction retried on a write conflict with other users, in place of ModelAdmin's atomic,
+        so that every attempt starts a new transaction. The form validation locks the records written with the object
+        (see LockedCheckFormMixin), so conflicts are shown on the bound form.
+        """
+        using = router.db_for_write(self.model)
+
+        def view():
+            if request.method == 'POST':
+                self.model.begin_write(using)
+            return self._changeform_view(request, object_id, form_url, extra_context)
+
+        return atomic_with_retry(view, using=using)
+
     def save_model(self, request, obj, form, change):
+        """
+        override of the ModelAdmin
+        Lock the records written with obj, repeat the validations and save them in a transaction,
+        retrying on a write conflict with other users if called outside a transaction.
+        """
+        version = obj.version
+        using = router.db_for_write(self.model, instance=obj)
+
+        def save():
+            obj.version = version
+            obj.begin_write(using)
+            records = obj.lock_records(using)
+            obj.check_locked_records(records)
+            self.save_locked_model(request, obj, form, change, records)
+
+        atomic_with_retry(save, using=using)
+
+    def save_locked_model(self, request, obj, form, change, records):
+        """
+        Save obj after the records returned by obj.lock_records() are locked.
+        """
         obj.updater = request.user.username
         obj.updated_at = timezone.now()
 
@@ -204,15 +475,12 @@ class TimeLinedTableAdminMixin(BaseTableAdminMixin):
     def get_validity_fieldsets(self, request, obj=None):
         return [(_('validity'), {'fields': self.model.get_validity_info_fieldsets()})]
 
-    def save_model(self, request, obj, form, change):
-        if change:
-            older_record = obj.older_record()
-            if older_record and obj != older_record:
-                older_record.end_date = obj.start_date - datetime.timedelta(days=1)
-                older_record.set_update_values(request.user.username)
-                older_record.save()
-        
-        super(TimeLinedTableAdminMixin, self).save_model(request, obj, form, change)
+    def save_locked_model(self, request, obj, form, change, records):
+        """
+        Close the older record and save obj, both under the lock of the unique key group.
+        """
+        obj.close_older_record(request.user.username, records)
+        super(TimeLinedTableAdminMixin, self).save_locked_model(request, obj, form, change, records)
 
     def get_form(self, request, obj=None, **kwargs):
         """
@@ -224,3 +492,22 @@ class TimeLinedTableAdminMixin(BaseTableAdminMixin):
             form.base_fields['start_date'].initial = datetime.date.today
     
         return form
+
+class CodeMasterAdminMixin(TimeLinedTableAdminMixin):
+    """
+    This is intended to be mixed with django.contrib.admin.ModelAdmin, and used to register CodeMaster
+    Searches codes and names with the n-gram index, and code categories with the cached code categories,
+    instead of icontains over CodeMaster and CodeCategory.
+    """
+    def get_search_results(self, request, queryset, search_term):
+        """
+        override of the ModelAdmin
+        """
+        if not search.get_search_grams(search_term):
+            return super(CodeMasterAdminMixin, self).get_search_results(request, queryset, search_term)
+
+        term = search.get_index_text(search_term)
+        codecategory_ids = [pk for pk, codecategory, name in get_codecategories()
+                            if term in search.get_index_text(codecategory) or term in search.get_index_text(name)]
+        codemaster_ids = search.search_ids(search_term).values('codemaster_id')
+        return queryset.filter(Q(pk__in=codemaster_ids) | Q(codecategory_id__in=codecategory_ids)), False
@@ -4,4 +4,7 @@ from django.utils.translation import gettext_lazy as _
 
 class CommonDataAppConfig(AppConfig):
     name = 'commndata'
-    verbose_name = _('Common Data')
\ No newline at end of file
+    verbose_name = _('Common Data')
+
+    def ready(self):
+        from commndata import checks, signals  # noqa: F401
@@ -0,0 +1,173 @@
+"""
+Process-wide cache of the CodeMaster timelines.
+
+Every code category is loaded with one query and stored in the django cache framework
+(settings.COMMNDATA_CACHE, default: 'default'). All entries share one generation number,
+which is bumped whenever a CodeCategory or a CodeMaster is written, so stale timelines are
+never read again and simply expire. The other processes only see the new generation through
+a shared cache(see commndata.checks).
+"""
+from bisect import bisect_right
+import datetime
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+GENERATION_KEY = 'commndata:codes:generation'
+PERMISSIONS_GENERATION_KEY = 'commndata:permissions:generation'
+
+# Counts the invalidations of the codes in this process, so that long-lived resolvers notice them without a cache read.
+local_generation = 0
+
+class CodeEntry(NamedTuple):
+    """
+    One period of a code, detached from the ORM so that it can be pickled into the cache.
+    """
+    code: str
+    name: str
+    value: str
+    display_order: Optional[int]
+    start_date: datetime.date
+    end_date: Optional[datetime.date]
+
+    def is_valid(self, as_of: datetime.date) -> bool:
+        return self.start_date <= as_of and (self.end_date is None or as_of <= self.end_date)
+
+class CodeTimeline():
+    """
+    All periods of all codes in a code category, sorted by start_date per code.
+    """
+    def __init__(self, codecategory: str, entries):
+        self.codecategory = codecategory
+        self.timelines = {}
+        for entry in sorted(entries, key=lambda e: (e.code, e.start_date)):
+            self.timelines.setdefault(entry.code, []).append(entry)
+        self.start_dates = {code: [e.start_date for e in periods] for code, periods in self.timelines.items()}
+
+    def __contains__(self, code) -> bool:
+        return code in self.timelines
+
+    def history(self, code) -> list:
+        return self.timelines.get(code, [])
+
+    def get(self, code, as_of: datetime.date = None) -> Optional[CodeEntry]:
+        """
+        Get the period of the code that is valid on as_of(default: today).
+        """
+        periods = self.timelines.get(code)
+        if not periods:
+            return None
+
+        as_of = as_of or datetime.date.today()
+        index = bisect_right(self.start_dates[code], as_of) - 1
+        if index < 0 or not periods[index].is_valid(as_of):
+            return None
+        return periods[index]
+
+    def valid_entries(self, as_of: datetime.date = None) -> list:
+        """
+        Get all codes valid on as_of(default: today), in display order.
+        """
+        entries = filter(None, (self.get(code, as_of) for code in self.timelines))
+        return sorted(entries, key=lambda e: (e.display_order is None, e.display_order, e.code))
+
+def get_cache():
+    return caches[getattr(settings, 'COMMNDATA_CACHE', 'default')]
+
+def get_timeout():
+    return getattr(settings, 'COMMNDATA_CACHE_TIMEOUT', 60 * 60)
+
+def get_generation(key: str = GENERATION_KEY) -> int:
+    cache = get_cache()
+    generation = cache.get(key)
+    if generation is None:
+        generation = 1
+        cache.add(key, generation, None)
+    return generation
+
+def invalidate(key: str = GENERATION_KEY) -> None:
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+def invalidate_codes() -> None:
+    """
+    Discard all cached timelines. Called after any write to CodeCategory or CodeMaster is committed.
+    """
+    global local_generation
+    local_generation += 1
+    invalidate(GENERATION_KEY)
+
+def invalidate_codes_on_commit(using=None) -> None:
+    transaction.on_commit(invalidate_codes, using=using)
+
+def invalidate_permissions() -> None:
+    """
+    Discard the cached permissions and app lists of the admin sites. Called after groups or permissions are changed.
+    """
+    invalidate(PERMISSIONS_GENERATION_KEY)
+
+def invalidate_permissions_on_commit(using=None) -> None:
+    transaction.on_commit(invalidate_permissions, using=using)
+
+def get_model_generation_key(model) -> str:
+    return 'commndata:generation:%s' % model._meta.label_lower
+
+def invalidate_model_on_commit(model, using=None) -> None:
+    """
+    Discard the data cached per model(e.g. the autocomplete results), once the current transaction is committed.
+    """
+    transaction.on_commit(lambda: invalidate(get_model_generation_key(model)), using=using)
+
+def get_or_set_model_data(model, name: str, default):
+    """
+    Get data cached for the current generation of model, calling default() on a miss.
+    """
+    cache = get_cache()
+    key = 'commndata:%s:%s:%s' % (model._meta.label_lower, get_generation(get_model_generation_key(model)), name)
+    data = cache.get(key)
+    if data is None:
+        data = default()
+        cache.set(key, data, get_timeout())
+    return data
+
+def load_timeline(codecategory: str) -> CodeTimeline:
+    """
+    Load all periods of a code category with one query.
+    """
+    from commndata.models import CodeMaster
+
+    rows = CodeMaster.objects.filter(codecategory__codecategory=codecategory) \
+                .order_by() \
+                .values_list(*CodeEntry._fields)
+    return CodeTimeline(codecategory, [CodeEntry(*row) for row in rows])
+
+def get_timeline(codecategory: str) -> CodeTimeline:
+    """
+    Get the timeline of a code category from the cache, loading it on a miss.
+    """
+    cache = get_cache()
+    key = 'commndata:codes:%s:%s' % (get_generation(), codecategory)
+    timeline = cache.get(key)
+    if timeline is None:
+        timeline = load_timeline(codecategory)
+        cache.set(key, timeline, get_timeout())
+    return timeline
+
+def get_codecategories() -> list:
+    """
+    Get (pk, codecategory, name) of all code categories in display order.
+    """
+    from commndata.models import CodeCategory
+
+    cache = get_cache()
+    key = 'commndata:codecategories:%s' % get_generation()
+    codecategories = cache.get(key)
+    if codecategories is None:
+        codecategories = list(CodeCategory.objects.order_by('display_order', 'pk').values_list('pk', 'codecategory', 'name'))
+        cache.set(key, codecategories, get_timeout())
+    return codecategories
@@ -0,0 +1,27 @@
+"""
+System checks of the commndata settings.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends whose entries are not seen by the other processes.
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The cached codes, permissions and autocomplete data are invalidated by a generation number in the cache,
+    so the processes of a deployment only see each other's writes through a shared cache.
+    """
+    alias = getattr(settings, 'COMMNDATA_CACHE', 'default')
+    if settings.CACHES.get(alias, {}).get('BACKEND') not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            "The cache '%s' used by commndata is local to each process, so a process keeps serving codes "
+            "and permissions changed in other processes until they expire." % alias,
+            hint='Use a cache shared by all processes(e.g. memcached, redis or the database) as settings.COMMNDATA_CACHE, '
+                 'or run a single process.',
+            id='commndata.W001',
+        )
+    ]
@@ -0,0 +1,56 @@
+"""
+Maintain CurrentCode, the table of the CodeMaster records valid today.
+
+Reading the currently effective code from CurrentCode is a unique index lookup, regardless of
+how long the history in CodeMaster is. The table is maintained only if settings.COMMNDATA_CURRENT_CODES is True:
+- every CodeMaster save or delete refreshes its code in the same transaction(see commndata.signals),
+- 'manage.py refresh_current_codes' must be scheduled just after the date rollover, to apply future-dated records,
+- 'manage.py rebuild_current_codes' rebuilds the whole table.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from commndata.models import CodeMaster, CurrentCode
+from commndata.query import keys_condition, valid_on
+
+def is_enabled() -> bool:
+    return getattr(settings, 'COMMNDATA_CURRENT_CODES', False)
+
+def refresh_current_codes(keys=None, as_of: datetime.date = None, using: str = None) -> int:
+    """
+    Replace the CurrentCode records of the (codecategory_id, code) keys(all codes if None) with the CodeMaster
+    records valid on as_of(default: today). Returns the number of current codes written.
+    Call this in the transaction that writes CodeMaster.
+    """
+    as_of = as_of or datetime.date.today()
+    codemasters = CodeMaster.objects.using(using).filter(valid_on(as_of)).order_by('start_date')
+    currentcodes = CurrentCode.objects.using(using).all()
+    if keys is not None:
+        keys = set(keys)
+        if not keys:
+            return 0
+        codemasters = codemasters.filter(keys_condition(keys))
+        currentcodes = currentcodes.filter(keys_condition(keys))
+
+    # When periods overlap, the one started later wins.
+    current = {(m.codecategory_id, m.code): m for m in codemasters}
+    currentcodes.delete()
+    CurrentCode.objects.using(using).bulk_create([
+        CurrentCode(
+            codecategory_id=m.codecategory_id, code=m.code, codemaster=m, name=m.name, value=m.value,
+            display_order=m.display_order, start_date=m.start_date, end_date=m.end_date,
+        ) for m in current.values()
+    ], batch_size=1000)
+    return len(current)
+
+def changed_keys(since: datetime.date, as_of: datetime.date = None, using: str = None) -> set:
+    """
+    Keys of the codes whose records became valid or expired after since, until as_of(default: today).
+    """
+    as_of = as_of or datetime.date.today()
+    return set(CodeMaster.objects.using(using)
+                .filter(Q(start_date__gt=since, start_date__lte=as_of) | Q(end_date__gte=since, end_date__lt=as_of))
+                .values_list('codecategory_id', 'code')
+                .distinct())
@@ -0,0 +1,115 @@
+import datetime
+from functools import partialmethod
+
+from django.core import exceptions
+from django.db import models
+from django.utils.text import capfirst
+from django.utils.translation import gettext_lazy as _
+
+from commndata.resolvers import get_resolver
+
+class CodeField(models.CharField):
+    """
+    A code of a code category, e.g. CodeField(category='pref').
+
+    Choices, the form widget and validation come from the CodeMaster timeline of the active resolver
+    (see commndata.resolvers.get_resolver), so full_clean() does not query CodeMaster, a request or a batch
+    loads each code category once, and changing the codes does not generate migrations.
+    The code is validated as of today, or as of the date stored in the instance's as_of_field.
+    """
+    default_error_messages = {
+        **models.CharField.default_error_messages,
+        'invalid_code': _('%(value)s is not a valid %(codecategory)s on %(as_of)s.'),
+    }
+
+    def __init__(self, *args, category: str = None, as_of_field: str = None, **kwargs):
+        kwargs.setdefault('max_length', 32)
+        self.codecategory = category
+        self.as_of_field = as_of_field
+        super(CodeField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(CodeField, self).deconstruct()
+        kwargs['category'] = self.codecategory
+        if self.as_of_field:
+            kwargs['as_of_field'] = self.as_of_field
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(CodeField, self).contribute_to_class(cls, name, *args, **kwargs)
+        setattr(cls, 'get_%s_display' % self.name, partialmethod(get_code_display, field=self))
+
+    def get_as_of(self, model_instance) -> datetime.date:
+        as_of = getattr(model_instance, self.as_of_field, None) if self.as_of_field else None
+        if isinstance(as_of, datetime.datetime):
+            return as_of.date()
+        return as_of or datetime.date.today()
+
+    def get_timeline(self):
+        return get_resolver().get_timeline(self.codecategory)
+
+    def get_entry(self, value, as_of: datetime.date = None):
+        return self.get_timeline().get(value, as_of)
+
+    def get_code_choices(self, include_blank=True, as_of: datetime.date = None) -> list:
+        choices = [(entry.code, entry.name) for entry in self.get_timeline().valid_entries(as_of)]
+        return [('', '---------')] + choices if include_blank else choices
+
+    def get_instance_choices(self, model_instance, include_blank=True) -> list:
+        """
+        Choices valid on the instance's as_of date, and the instance's code even if it is not valid then,
+        so that editing an old record never changes its code silently.
+        """
+        choices = self.get_code_choices(include_blank, self.get_as_of(model_instance))
+        value = getattr(model_instance, self.attname)
+        if value not in self.empty_values and value not in {code for code, name in choices}:
+            history = self.get_timeline().history(value)
+            choices.append((value, history[-1].name if history else value))
+        return choices
+
+    def validate(self, value, model_instance):
+        super(CodeField, self).validate(value, model_instance)
+        if value in self.empty_values:
+            return
+
+        as_of = self.get_as_of(model_instance)
+        if not self.get_entry(value, as_of):
+            raise exceptions.ValidationError(
+                self.error_messages['invalid_code'],
+                code='invalid_code',
+                params={'value': value, 'codecategory': self.verbose_name, 'as_of': as_of},
+            )
+
+    def formfield(self, **kwargs):
+        # commndata.forms depends on django.contrib.auth, which may not be loaded yet when models are imported.
+        from commndata.forms import CodeChoiceField
+
+        include_blank = self.blank or not (self.has_default() or 'initial' in kwargs)
+        defaults = {
+            'required': not self.blank,
+            'label': capfirst(self.verbose_name),
+            'help_text': self.help_text,
+            'codecategory': self.codecategory,
+            'instance_choices': lambda instance: self.get_instance_choices(instance, include_blank),
+            'choices': lambda: self.get_code_choices(include_blank),
+            'coerce': self.to_python,
+            'empty_value': None if self.null else '',
+        }
+        if self.has_default():
+            defaults['initial'] = self.get_default()
+
+        # The admin passes a text input for CharField, but codes are always selected from a list.
+        widget = kwargs.get('widget')
+        if widget is not None and not issubclass(widget if isinstance(widget, type) else widget.__class__, CodeChoiceField.widget):
+            del kwargs['widget']
+
+        for k in list(kwargs):
+            if k not in ('coerce', 'empty_value', 'choices', 'required', 'widget', 'label', 'initial',
+                         'help_text', 'error_messages', 'show_hidden_initial', 'disabled'):
+                del kwargs[k]
+        return CodeChoiceField(**{**defaults, **kwargs})
+
+def get_code_display(instance, field: CodeField):
+    value = getattr(instance, field.attname)
+    entry = field.get_entry(value, field.get_as_of(instance)) if value else None
+    return entry.name if entry else value
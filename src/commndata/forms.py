@@ -1,7 +1,8 @@
 from django.contrib.admin.forms import AdminAuthenticationForm, AuthenticationForm
 from django.core.exceptions import ValidationError
+from django.db import router, transaction
 from django.utils.translation import gettext_lazy as _
-from django.forms import ModelForm
+from django.forms import ModelForm, TypedChoiceField
 
 class SuperUserAuthenticationForm(AdminAuthenticationForm):
     """
@@ -32,6 +33,24 @@ class ActiveUserAuthenticationForm(AuthenticationForm):
     def confirm_login_allowed(self, user):
         super(ActiveUserAuthenticationForm, self).confirm_login_allowed(user)
 
+class LockedCheckFormMixin():
+    """
+    Repeat the validations of BaseTable.check_locked_records() with the records locked, at the end of the validation
+    of a ModelForm of a BaseTable, so that a conflict with other users is shown on the bound form.
+    The locks are only taken in a transaction(e.g. the admin's changeform_view), and held until it ends.
+    """
+    def _post_clean(self):
+        super(LockedCheckFormMixin, self)._post_clean()
+        using = router.db_for_write(self.instance.__class__, instance=self.instance)
+        if self._errors or not transaction.get_connection(using).in_atomic_block:
+            return
+
+        try:
+            records = self.instance.lock_records(using)
+            self.instance.check_locked_records(records)
+        except ValidationError as e:
+            self._update_errors(e)
+
 class TimeLinedTable(ModelForm):
     error_messages = {
         'invalid_period': _(
@@ -51,4 +70,31 @@ class TimeLinedTable(ModelForm):
                 self.error_messages['invalid_period'],
                 code='invalid_period',
                 params = {'end_date': end_label, 'start_date': start_label}
-            )
\ No newline at end of file
+            )
+
+class CodeChoiceField(TypedChoiceField):
+    """
+    Form field of commndata.fields.CodeField.
+    Any code of the code category is accepted here, and the validity period is checked by the model field,
+    since it may depend on a date field of the instance.
+    In a ModelForm, the choices are those of the form's instance(see CodeField.get_instance_choices).
+    """
+    def __init__(self, *, codecategory=None, instance_choices=None, **kwargs):
+        self.codecategory = codecategory
+        self.instance_choices = instance_choices
+        super(CodeChoiceField, self).__init__(**kwargs)
+
+    def get_bound_field(self, form, field_name):
+        # form.fields are copies per form, so the choices are set for this form only.
+        instance = getattr(form, 'instance', None)
+        if self.instance_choices is not None and instance is not None:
+            self.choices = self.instance_choices(instance)
+            self.instance_choices = None
+        return super(CodeChoiceField, self).get_bound_field(form, field_name)
+
+    def valid_value(self, value):
+        from commndata.resolvers import get_resolver
+
+        if self.codecategory is None:
+            return super(CodeChoiceField, self).valid_value(value)
+        return str(value) in get_resolver().get_timeline(self.codecategory)
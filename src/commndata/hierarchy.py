@@ -0,0 +1,135 @@
+"""
+Hierarchies of codes, e.g. region > prefecture > city.
+
+CodeRelation records the parent of a code during a period. CodeClosure holds every path from an ancestor to
+a descendant with the period in which all relations on the path are valid, so that all descendants or ancestors
+of a code as of a date are one indexed query:
+
+    descendant_codes('region', 'kanto', 'pref')        # a queryset usable in filter(pref__in=...)
+    ancestors('pref', '13', as_of=datetime.date(2000, 4, 1))
+
+CodeClosure is refreshed in the same transaction as CodeRelation's save and delete(see commndata.signals),
+and rebuilt after CSV imports or by 'manage.py rebuild_code_closure'.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db.models import QuerySet
+
+from commndata.models import CodeClosure, CodeRelation
+from commndata.query import keys_condition, valid_on
+
+def intersect(start_date, end_date, other_start_date, other_end_date):
+    """
+    Intersection of two periods, where end_date None means open-ended. Returns None if they don't overlap.
+    """
+    start = max(start_date, other_start_date)
+    end = min(filter(None, (end_date, other_end_date)), default=None)
+    return (start, end) if end is None or start <= end else None
+
+def load_relations(children=None, using: str = None, chunk_size: int = 250) -> dict:
+    """
+    Load the relations of the children(all relations if None): child -> [(parent, start_date, end_date)],
+    where codes are (codecategory_id, code). One query per chunk_size children.
+    """
+    relations = defaultdict(list)
+    rows = CodeRelation.objects.using(using).order_by() \
+            .values_list('child_category_id', 'child_code', 'parent_category_id', 'parent_code', 'start_date', 'end_date')
+    if children is None:
+        chunks = [rows]
+    else:
+        children = sorted(children)
+        chunks = [rows.filter(keys_condition(children[start:start + chunk_size], 'child_category_id', 'child_code'))
+                  for start in range(0, len(children), chunk_size)]
+    for chunk in chunks:
+        for child_category_id, child_code, parent_category_id, parent_code, start_date, end_date in chunk:
+            relations[child_category_id, child_code].append(((parent_category_id, parent_code), start_date, end_date))
+    return relations
+
+def load_ancestor_relations(nodes: set, using: str = None) -> dict:
+    """
+    Load only the relations on the paths up from nodes: those of the nodes and of their ancestors already
+    in CodeClosure at once, then those of the ancestors that are not there yet(e.g. a new parent) level by level.
+    """
+    pending = set(nodes)
+    pending |= set(CodeClosure.objects.using(using).filter(keys_condition(nodes, 'descendant_category_id', 'descendant_code'))
+                       .values_list('ancestor_category_id', 'ancestor_code'))
+    relations = defaultdict(list)
+    while pending:
+        loaded = load_relations(pending, using)
+        for child in pending:
+            relations[child] = loaded[child]
+        pending = {parent for parents in loaded.values() for parent, start_date, end_date in parents} - set(relations)
+    return relations
+
+def ancestor_paths(node, relations: dict):
+    """
+    Yield (ancestor, depth, start_date, end_date) of every path from node up to its ancestors.
+    """
+    def walk(child, depth, start_date, end_date, visited):
+        for parent, relation_start_date, relation_end_date in relations.get(child, ()):
+            period = intersect(start_date, end_date, relation_start_date, relation_end_date)
+            if period is None or parent in visited:
+                continue
+            yield (parent, depth, *period)
+            yield from walk(parent, depth + 1, *period, visited | {parent})
+
+    yield from walk(node, 1, datetime.date.min, None, {node})
+
+def refresh_code_closure(nodes=None, using: str = None) -> int:
+    """
+    Rebuild the paths to the (codecategory_id, code) nodes and to their descendants(all paths if None).
+    Returns the number of paths written. Call this in the transaction that writes CodeRelation.
+    """
+    closures = CodeClosure.objects.using(using).all()
+    if nodes is None:
+        relations = load_relations(using=using)
+        nodes = set(relations)
+    else:
+        nodes = set(nodes)
+        if not nodes:
+            return 0
+        # The descendants' paths run through nodes, so they are refreshed too.
+        nodes |= set(closures.filter(keys_condition(nodes, 'ancestor_category_id', 'ancestor_code'))
+                        .values_list('descendant_category_id', 'descendant_code'))
+        closures = closures.filter(keys_condition(nodes, 'descendant_category_id', 'descendant_code'))
+        relations = load_ancestor_relations(nodes, using)
+
+    closures.delete()
+    paths = [
+        CodeClosure(ancestor_category_id=ancestor[0], ancestor_code=ancestor[1],
+                    descendant_category_id=node[0], descendant_code=node[1],
+                    depth=depth, start_date=start_date, end_date=end_date)
+        for node in nodes for ancestor, depth, start_date, end_date in ancestor_paths(node, relations)
+    ]
+    CodeClosure.objects.using(using).bulk_create(paths, batch_size=1000)
+    return len(paths)
+
+def rebuild_code_closure(using: str = None) -> int:
+    return refresh_code_closure(using=using)
+
+def descendants(codecategory: str, code: str, as_of: datetime.date = None, descendant_category: str = None) -> QuerySet:
+    """
+    Paths from the code to all its descendants(of descendant_category, if given) valid on as_of(default: today).
+    """
+    paths = CodeClosure.objects.filter(ancestor_category__codecategory=codecategory, ancestor_code=code) \
+                .filter(valid_on(as_of or datetime.date.today()))
+    if descendant_category:
+        paths = paths.filter(descendant_category__codecategory=descendant_category)
+    return paths.order_by('depth', 'descendant_code')
+
+def ancestors(codecategory: str, code: str, as_of: datetime.date = None, ancestor_category: str = None) -> QuerySet:
+    """
+    Paths from all ancestors(of ancestor_category, if given) of the code valid on as_of(default: today), the parent first.
+    """
+    paths = CodeClosure.objects.filter(descendant_category__codecategory=codecategory, descendant_code=code) \
+                .filter(valid_on(as_of or datetime.date.today()))
+    if ancestor_category:
+        paths = paths.filter(ancestor_category__codecategory=ancestor_category)
+    return paths.order_by('depth')
+
+def descendant_codes(codecategory: str, code: str, descendant_category: str, as_of: datetime.date = None) -> QuerySet:
+    """
+    Codes of the descendants in descendant_category, e.g. Sales.objects.filter(pref__in=descendant_codes('region', 'kanto', 'pref')).
+    """
+    return descendants(codecategory, code, as_of, descendant_category).order_by().values_list('descendant_code', flat=True)
@@ -0,0 +1,157 @@
+"""
+Import a full list of records into a BaseTable model, writing only the records that changed.
+
+Feeds usually deliver every record every time, while only a few of them changed. import_rows() matches
+the rows with the stored records by pk or by the model unique key(see BaseTable.get_model_unique_key),
+compares their content hashes(see BaseTable.content_hash) and
+- skips the unchanged records: no write, no version bump, so editors' optimistic locks are not disturbed,
+- bulk updates the changed records with set_update_values(),
+- bulk creates the new records with get_init_values().
+The derived tables(CodeSearchIndex, CurrentCode, CodeClosure) are refreshed for the written records only,
+in the same transaction(see BaseTableQuerySet). Used by 'manage.py import_csv'.
+"""
+import csv
+from typing import Iterator, NamedTuple
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+class ImportResult(NamedTuple):
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def __add__(self, other):
+        return ImportResult(*(a + b for a, b in zip(self, other)))
+
+class ImportCounter():
+    """
+    Counts of an import whose rows are written by another library, e.g. the admin CSV import of checked_csv.
+    Records marked with it(BaseTable.import_counter) are compared with the stored records by bulk_update().
+    """
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+
+    def result(self) -> ImportResult:
+        return ImportResult(self.inserted, self.updated, self.unchanged)
+
+def exclude_unchanged(model, objs: list, using: str = None, chunk_size: int = 250) -> list:
+    """
+    Leave out the records marked with an ImportCounter that equal the stored records, and count them.
+    The marks are cleared, so a later bulk_update() of the same instances writes them.
+    """
+    marked = [obj for obj in objs if obj.import_counter is not None]
+    if not marked:
+        return objs
+
+    stored = {}
+    pks = [obj.pk for obj in marked]
+    for start in range(0, len(pks), chunk_size):
+        stored.update(model.get_stored_content_hashes(model._base_manager.using(using).filter(pk__in=pks[start:start + chunk_size])))
+    unchanged = set()
+    for obj in marked:
+        counter, obj.import_counter = obj.import_counter, None
+        if stored.get(obj.pk) == obj.content_hash():
+            counter.unchanged += 1
+            unchanged.add(id(obj))
+        else:
+            counter.updated += 1
+    return [obj for obj in objs if id(obj) not in unchanged]
+
+def get_key_attnames(model) -> tuple:
+    return tuple(model._meta.get_field(name).attname for name in model().get_model_unique_key)
+
+def get_key(obj, key_attnames: tuple) -> tuple:
+    return tuple(getattr(obj, attname) for attname in key_attnames)
+
+def load_stored(model, objs: list, key_attnames: tuple, using: str = None, chunk_size: int = 250) -> tuple:
+    """
+    Stored (pk, version, content hash) of the objs, by pk and by unique key, with one query per chunk_size objs
+    (small enough for the query parameter limits of SQLite).
+    """
+    fields = [f.attname for f in model.get_content_fields()]
+    by_pk, by_key = {}, {}
+    for start in range(0, len(objs), chunk_size):
+        chunk = objs[start:start + chunk_size]
+        pks = [obj.pk for obj in chunk if obj.pk is not None]
+        keys = [get_key(obj, key_attnames) for obj in chunk if obj.pk is None and key_attnames]
+        if not pks and not keys:
+            continue
+
+        condition = Q(pk__in=pks)
+        for key in keys:
+            condition |= Q(**dict(zip(key_attnames, key)))
+        rows = model.objects.using(using).filter(condition).order_by() \
+                    .values_list('pk', 'version', *key_attnames, *fields)
+        for pk, version, *values in rows:
+            stored = (pk, version, model.get_content_hash(values[len(key_attnames):]))
+            by_pk[pk] = stored
+            by_key[tuple(values[:len(key_attnames)])] = stored
+    return by_pk, by_key
+
+def import_chunk(model, objs: list, username: str, key_attnames: tuple, using: str = None) -> ImportResult:
+    by_pk, by_key = load_stored(model, objs, key_attnames, using)
+    inserts, updates, unchanged = [], [], 0
+    for obj in objs:
+        stored = by_pk.get(obj.pk) if obj.pk is not None else by_key.get(get_key(obj, key_attnames))
+        if stored is None:
+            for k, v in model.get_init_values(username).items():
+                setattr(obj, k, v)
+            inserts.append(obj)
+        elif stored[2] == obj.content_hash():
+            unchanged += 1
+        else:
+            obj.pk, obj.version = stored[0], stored[1]
+            obj.set_update_values(username)
+            updates.append(obj)
+
+    fields = [f.name for f in model.get_content_fields()] + list(model.get_autoupdatable_fields())
+    model.objects.using(using).bulk_update(updates, fields)
+    model.objects.using(using).bulk_create(inserts)
+    return ImportResult(len(inserts), len(updates), unchanged)
+
+def import_rows(model, objs, username: str, using: str = None, batch_size: int = 500) -> ImportResult:
+    """
+    Import unsaved model instances in one transaction, and return the numbers of inserted, updated and unchanged records.
+    Instances without pk are matched by the model unique key, so the model needs one to import them.
+    """
+    key_attnames = get_key_attnames(model)
+    result = ImportResult()
+    with transaction.atomic(using=using):
+        chunk = []
+        for obj in objs:
+            if obj.pk is None and not key_attnames:
+                raise ValueError('%s has no unique key to match the records without pk.' % model.__name__)
+            chunk.append(obj)
+            if len(chunk) >= batch_size:
+                result += import_chunk(model, chunk, username, key_attnames, using)
+                chunk = []
+        if chunk:
+            result += import_chunk(model, chunk, username, key_attnames, using)
+    return result
+
+def read_csv(model, file) -> Iterator:
+    """
+    Yield model instances from a csv file with a header of field names, e.g. the csv files in commndata/data.
+    Columns of get_readonly_fields() are ignored. Raises ValidationError with the line number for invalid rows.
+    Foreign keys are not looked up row by row, the database constraints reject unknown ones.
+    """
+    readonly_fields = model.get_readonly_fields()
+    reader = csv.DictReader(file)
+    fields = [model._meta.get_field(name) for name in reader.fieldnames if name not in readonly_fields]
+    exclude = list(readonly_fields) + [f.name for f in fields if f.is_relation]
+    for row in reader:
+        obj = model()
+        try:
+            for field in fields:
+                value = row[field.name]
+                if value == '' and (field.null or field.primary_key):
+                    value = None
+                setattr(obj, field.attname, field.to_python(value))
+            obj.clean_fields(exclude=exclude)
+        except ValidationError as e:
+            raise ValidationError('line %d: %s' % (reader.line_num, '; '.join(e.messages)))
+        yield obj
@@ -0,0 +1,29 @@
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from commndata.importing import import_rows, read_csv
+
+class Command(BaseCommand):
+    help = 'Import a csv file of all records into a BaseTable model, writing only the new and changed records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Model label, e.g. commndata.CodeMaster.')
+        parser.add_argument('csv_file')
+        parser.add_argument('--username', default='import', help='Creator and updater of the written records.')
+        parser.add_argument('--encoding', default='utf-8-sig')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        try:
+            with open(options['csv_file'], encoding=options['encoding'], newline='') as file:
+                result = import_rows(model, read_csv(model, file), options['username'], using=options['database'])
+        except (ValidationError, ValueError) as e:
+            raise CommandError('; '.join(getattr(e, 'messages', [str(e)])))
+        self.stdout.write('%d inserted, %d updated, %d unchanged.' % result)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from commndata.hierarchy import rebuild_code_closure
+
+class Command(BaseCommand):
+    help = 'Rebuild the whole CodeClosure table from CodeRelation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            count = rebuild_code_closure(using=options['database'])
+        self.stdout.write('%d paths.' % count)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from commndata.current import refresh_current_codes
+
+class Command(BaseCommand):
+    help = 'Rebuild the whole CurrentCode table from CodeMaster.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            count = refresh_current_codes(using=options['database'])
+        self.stdout.write('%d current codes.' % count)
@@ -0,0 +1,25 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from commndata.current import changed_keys, refresh_current_codes
+
+class Command(BaseCommand):
+    help = 'Apply the CodeMaster records which became valid or expired since the last date rollover to CurrentCode. ' \
+           'Schedule this just after midnight.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help='Date of the last refresh(YYYY-MM-DD), default: yesterday.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        since = options['since'] or today - datetime.timedelta(days=1)
+        using = options['database']
+
+        with transaction.atomic(using=using):
+            keys = changed_keys(since, today, using=using)
+            count = refresh_current_codes(keys, today, using=using)
+        self.stdout.write('%d codes refreshed, %d current codes.' % (len(keys), count))
@@ -0,0 +1,17 @@
+from commndata.resolvers import CodeResolver, activate, deactivate
+
+class CodeResolverMiddleware():
+    """
+    Activate a request-scoped CodeResolver, so that the codename/codevalue template filters
+    resolve each code category only once per request.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.code_resolver = CodeResolver()
+        activate(request.code_resolver)
+        try:
+            return self.get_response(request)
+        finally:
+            deactivate()
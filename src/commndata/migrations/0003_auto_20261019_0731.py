@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commndata', '0002_auto_20210509_1007'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=32, verbose_name='code')),
+                ('name', models.CharField(max_length=128, verbose_name='name')),
+                ('value', models.CharField(blank=True, max_length=128, verbose_name='value')),
+                ('display_order', models.IntegerField(blank=True, null=True)),
+                ('start_date', models.DateField(verbose_name='start_date')),
+                ('end_date', models.DateField(blank=True, null=True, verbose_name='end_date')),
+                ('codecategory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='commndata.codecategory', verbose_name='code category')),
+                ('codemaster', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='current', to='commndata.codemaster', verbose_name='code master')),
+            ],
+            options={
+                'verbose_name': 'current code',
+                'verbose_name_plural': 'current code',
+                'ordering': ['codecategory', 'display_order', 'code'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='currentcode',
+            constraint=models.UniqueConstraint(fields=('codecategory', 'code'), name='currentcode_unique'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commndata', '0003_auto_20261019_0731'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeRelation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField(default=1, verbose_name='version')),
+                ('created_at', models.DateTimeField(serialize=False, verbose_name='created_at')),
+                ('creator', models.CharField(max_length=120, serialize=False, verbose_name='creator')),
+                ('updated_at', models.DateTimeField(serialize=False, verbose_name='updated_at')),
+                ('updater', models.CharField(max_length=120, serialize=False, verbose_name='updater')),
+                ('start_date', models.DateField(verbose_name='start_date')),
+                ('end_date', models.DateField(blank=True, null=True, verbose_name='end_date')),
+                ('parent_code', models.CharField(max_length=32, verbose_name='parent code')),
+                ('child_code', models.CharField(max_length=32, verbose_name='child code')),
+                ('child_category', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='commndata.codecategory', verbose_name='child code category')),
+                ('parent_category', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='commndata.codecategory', verbose_name='parent code category')),
+            ],
+            options={
+                'verbose_name': 'code relation',
+                'verbose_name_plural': 'code relation',
+                'ordering': ['parent_category', 'parent_code', 'child_category', 'child_code', '-start_date'],
+                'permissions': [('import_coderelation', 'Can import Code Relation'), ('export_coderelation', 'Can export Code Relation')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CodeClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_code', models.CharField(max_length=32)),
+                ('descendant_code', models.CharField(max_length=32)),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('ancestor_category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commndata.codecategory')),
+                ('descendant_category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commndata.codecategory')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='coderelation',
+            constraint=models.UniqueConstraint(fields=('start_date', 'child_category', 'child_code'), name='coderelation_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='codeclosure',
+            index=models.Index(fields=['ancestor_category', 'ancestor_code', 'start_date'], name='codeclosure_ancestor'),
+        ),
+        migrations.AddIndex(
+            model_name='codeclosure',
+            index=models.Index(fields=['descendant_category', 'descendant_code', 'start_date'], name='codeclosure_descendant'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:36
+
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copies of commndata.search as of this migration, so that later changes to the index do not change it.
+def normalize_search_text(value):
+    text = unicodedata.normalize('NFKC', str(value)).casefold()
+    return ''.join(chr(ord(c) - 0x60) if 'ァ' <= c <= 'ヶ' else c for c in text)
+
+
+def get_index_text(value):
+    return ''.join(normalize_search_text(value).split())
+
+
+def get_grams(text):
+    grams = {}
+    for n in (1, 2):
+        for position in range(len(text) - n + 1):
+            grams.setdefault(text[position:position + n], position)
+    return grams
+
+
+def build_search_index(apps, schema_editor):
+    CodeMaster = apps.get_model('commndata', 'CodeMaster')
+    CodeSearchIndex = apps.get_model('commndata', 'CodeSearchIndex')
+    using = schema_editor.connection.alias
+    rows = []
+    for codemaster in CodeMaster.objects.using(using).iterator():
+        grams = {}
+        texts = [get_index_text(text) for text in (codemaster.name, codemaster.code) if text]
+        for text in texts:
+            for gram, position in get_grams(text).items():
+                grams[gram] = min(grams.get(gram, position), position)
+        length = min(max(map(len, texts), default=0), 32767)
+        rows.extend(
+            CodeSearchIndex(codemaster_id=codemaster.pk, codecategory_id=codemaster.codecategory_id,
+                            gram=gram, position=min(position, 32767), length=length)
+            for gram, position in grams.items()
+        )
+    CodeSearchIndex.objects.using(using).bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commndata', '0004_auto_20261019_0735'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSearchIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('length', models.PositiveSmallIntegerField()),
+                ('codecategory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commndata.codecategory')),
+                ('codemaster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commndata.codemaster')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='codesearchindex',
+            index=models.Index(fields=['gram', 'codecategory'], name='codesearchindex_gram'),
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+import datetime
+import hashlib
+
+from django.db import connections, models, router, transaction
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -6,6 +9,52 @@ from django.utils.functional import cached_property
 from django.core.exceptions import ObjectDoesNotExist
 
 # Create your models here.
+class BaseTableQuerySet(models.QuerySet):
+    """
+    Bulk writes(e.g. CSV imports) send no signals, so they refresh what commndata.signals refreshes on save
+    once the records are written, in the same transaction. bulk_update() skips the unchanged records of an import
+    (see commndata.importing.ImportCounter).
+    """
+    def bulk_create(self, objs, *args, **kwargs):
+        # commndata.signals imports this module.
+        from commndata.signals import bulk_written
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super(BaseTableQuerySet, self).bulk_create(objs, *args, **kwargs)
+            self.set_missing_pks(objs)
+            bulk_written(self.model, objs, self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from commndata.importing import exclude_unchanged
+        from commndata.signals import bulk_written
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Unchanged rows of an import are neither written nor refreshed.
+            objs = exclude_unchanged(self.model, list(objs), self.db)
+            result = super(BaseTableQuerySet, self).bulk_update(objs, fields, *args, **kwargs)
+            bulk_written(self.model, objs, self.db)
+        return result
+
+    def set_missing_pks(self, objs: list, chunk_size: int = 250) -> None:
+        """
+        Set the pks the backend does not return from bulk_create, by the model unique key.
+        """
+        missing = [obj for obj in objs if obj.pk is None]
+        key_attnames = [self.model._meta.get_field(name).attname for name in self.model().get_model_unique_key]
+        if not missing or not key_attnames:
+            return
+
+        records = self.model._base_manager.using(self.db).order_by()
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            condition = models.Q()
+            for obj in chunk:
+                condition |= models.Q(**{k: getattr(obj, k) for k in key_attnames})
+            pks = {tuple(row[1:]): row[0] for row in records.filter(condition).values_list('pk', *key_attnames)}
+            for obj in chunk:
+                obj.pk = pks.get(tuple(getattr(obj, k) for k in key_attnames))
+
 class BaseTable(models.Model):
     version = models.IntegerField(verbose_name = _('version'), blank = False, default = 1)
     created_at = models.DateTimeField(verbose_name = _('created_at'), blank = False, serialize=False)
@@ -13,6 +62,8 @@ class BaseTable(models.Model):
     updated_at = models.DateTimeField(verbose_name = _('updated_at'), blank = False, serialize=False)
     updater = models.CharField(max_length = 120, verbose_name = _('updater'), blank = False, serialize=False)
 
+    objects = BaseTableQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
@@ -20,8 +71,18 @@ class BaseTable(models.Model):
         'optimistic_exclusion_violation': _(
             'This %(instance_name)s maybe already changed by other users. Please reopen the screen.'
         ),
+        'conflicting_changes': _(
+            'Other users have changed %(fields)s of this %(instance_name)s. Please reopen the screen.'
+        ),
     }
 
+    # Opt-in: merge the changes of other users instead of rejecting the save, unless the same fields were changed.
+    # The values the edit started from must be set to loaded_values, see get_loaded_values().
+    merge_concurrent_changes = False
+    loaded_values = None
+    # The ImportCounter of the import that reads this record, see commndata.importing.exclude_unchanged().
+    import_counter = None
+
     @staticmethod
     def get_init_values(username: str):
         return  {
@@ -48,6 +109,34 @@ class BaseTable(models.Model):
     def get_autoupdatable_fields():
         return ('updater', 'updated_at', 'version')
 
+    @classmethod
+    def get_content_fields(cls) -> list:
+        """
+        Fields compared to detect changes: all concrete fields except the primary key and get_readonly_fields().
+        """
+        readonly_fields = cls.get_readonly_fields()
+        return [f for f in cls._meta.concrete_fields if not f.primary_key and f.name not in readonly_fields]
+
+    @classmethod
+    def get_content_hash(cls, values) -> str:
+        """
+        Hash of the values of get_content_fields(), in the same order.
+        """
+        content = repr([f.to_python(v) for f, v in zip(cls.get_content_fields(), values)])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_stored_content_hashes(cls, queryset=None) -> dict:
+        """
+        Content hashes of the stored records by pk, computed in bulk.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        fields = [f.attname for f in cls.get_content_fields()]
+        return {row[0]: cls.get_content_hash(row[1:]) for row in queryset.order_by().values_list('pk', *fields).iterator()}
+
+    def content_hash(self) -> str:
+        return self.get_content_hash([getattr(self, f.attname) for f in self.get_content_fields()])
+
     @staticmethod
     def get_update_info_fieldsets():
         return [('creator', 'created_at'), ('updater', 'updated_at', 'version')]
@@ -77,13 +166,15 @@ class BaseTable(models.Model):
     def get_model_unique_values(self) -> dict:
         return {k:getattr(self, k) for k in self.get_model_unique_key}
 
-    def optimistic_exclusion_check(self) -> None:
+    def optimistic_exclusion_check(self, latest=None) -> None:
         """
         Optimistic violation check using version field.
         """
         if self.pk:
-            latest = self.__class__.objects.get(pk=self.pk)
-            if latest.version > self.version:
+            latest = latest or self.__class__.objects.get(pk=self.pk)
+            if latest.version > self.version and self.merge_concurrent_changes and self.loaded_values is not None:
+                self.merge_changes(latest)
+            elif latest.version > self.version:
                 # name = self._meta.verbose_name.title()
                 raise ValidationError(
                     self.error_messages['optimistic_exclusion_violation'],
@@ -91,11 +182,78 @@ class BaseTable(models.Model):
                     params={'instance_name': self}
                 )
 
+    def get_loaded_values(self) -> dict:
+        """
+        Serializable content values, to be kept while the record is edited and set to loaded_values on save.
+        """
+        return {f.attname: None if getattr(self, f.attname) is None else f.value_to_string(self) for f in self.get_content_fields()}
+
+    def merge_changes(self, latest) -> None:
+        """
+        Take over the fields changed by other users since loaded_values into this record,
+        and raise a ValidationError if both sides changed a field to different values.
+        """
+        fields = self.get_content_fields()
+        loaded = {f.attname: f.to_python(self.loaded_values.get(f.attname)) for f in fields}
+        mine = {f for f in fields if getattr(self, f.attname) != loaded[f.attname]}
+        theirs = {f for f in fields if getattr(latest, f.attname) != loaded[f.attname]}
+        conflicts = [f for f in fields if f in mine & theirs and getattr(self, f.attname) != getattr(latest, f.attname)]
+        if conflicts:
+            raise ValidationError(
+                self.error_messages['conflicting_changes'],
+                code = 'conflicting_changes',
+                params={'instance_name': self, 'fields': ', '.join(str(f.verbose_name) for f in conflicts)}
+            )
+
+        for f in theirs - mine:
+            setattr(self, f.attname, getattr(latest, f.attname))
+        # From now on, the latest record is what this edit started from.
+        self.loaded_values = {**latest.get_loaded_values(), **{f.attname: self.loaded_values.get(f.attname) for f in mine - theirs}}
+        self.version = latest.version
+
     def clean(self) -> None:
         super(BaseTable, self).clean()
 
         self.optimistic_exclusion_check()
 
+    def get_lock_queryset(self) -> models.QuerySet:
+        """
+        Records to be locked while this record is written.
+        """
+        if self.pk:
+            return self.__class__.objects.filter(pk=self.pk)
+        return self.__class__.objects.none()
+
+    @classmethod
+    def begin_write(cls, using=None) -> None:
+        """
+        Take the write lock with the first statement of the transaction on backends without select_for_update.
+        SQLite locks the whole database: a transaction that has read fails at once with 'database is locked'
+        when it writes after another writer, while its first statement waits for the busy timeout.
+        Must be called at the start of a transaction, see commndata.transactions.atomic_with_retry.
+        """
+        using = using or router.db_for_write(cls)
+        if not connections[using].features.has_select_for_update:
+            # A no-op UPDATE, which matches no row but takes the lock.
+            cls._base_manager.using(using).filter(pk__isnull=True).update(version=models.F('version'))
+
+    def lock_records(self, using=None) -> list:
+        """
+        Lock the records of get_lock_queryset() with select_for_update, without waiting if the database supports it.
+        Must be called in a transaction, see commndata.transactions.atomic_with_retry.
+        """
+        using = using or router.db_for_write(self.__class__, instance=self)
+        nowait = connections[using].features.has_select_for_update_nowait
+        return list(self.get_lock_queryset().using(using).select_for_update(nowait=nowait).order_by('pk'))
+
+    def check_locked_records(self, records: list) -> None:
+        """
+        Validations that must be repeated after lock_records(), since other users may have written in the meantime.
+        """
+        latest = next((r for r in records if r.pk == self.pk), None) if self.pk else None
+        if latest:
+            self.optimistic_exclusion_check(latest)
+
 class TimeLinedTable(BaseTable):
     start_date = models.DateField(verbose_name = _('start_date'), blank = False, null = False)
     end_date = models.DateField(verbose_name = _('end_date'), blank = True, null = True)
@@ -118,11 +276,15 @@ class TimeLinedTable(BaseTable):
     def get_model_constraint_values(self) -> dict:
         return {k:getattr(self, k) for k in self.get_model_unique_key if k != 'start_date'}
 
-    def newer_record(self):
+    def newer_record(self, records: list = None):
         """
             Detect if there is a record with a newer start_date.
             Here the unique constraint must contains a start_date field.
+            If records(e.g. locked by lock_records) are given, the record is searched from them.
         """
+        if records is not None:
+            return min(filter(lambda r: r.start_date > self.start_date, records), key=lambda r: r.start_date, default=None)
+
         newer_records = self.__class__.objects.filter(**self.get_model_constraint_values) \
                         .filter(start_date__gt=self.start_date) \
                         .order_by('start_date')
@@ -131,11 +293,15 @@ class TimeLinedTable(BaseTable):
         else:
             None
     
-    def older_record(self):
+    def older_record(self, records: list = None):
         """
             Detect if there is a record with a older start_date.
             Here the unique constraint must contains a start_date field.
+            If records(e.g. locked by lock_records) are given, the record is searched from them.
         """
+        if records is not None:
+            return max(filter(lambda r: r.start_date < self.start_date, records), key=lambda r: r.start_date, default=None)
+
         older_records = self.__class__.objects.filter(**self.get_model_constraint_values) \
                         .filter(start_date__lt=self.start_date) \
                         .order_by('-start_date')
@@ -144,12 +310,12 @@ class TimeLinedTable(BaseTable):
         else:
             None
 
-    def history_check(self):
+    def history_check(self, records: list = None):
         """
         If there is a newer record(start_date is newer), then create and update are not allowed.
         """
         try:
-            newer_record = self.newer_record()
+            newer_record = self.newer_record(records)
             if newer_record and self != newer_record:
                 # name = self._meta.verbose_name.title()
                 raise ValidationError(
@@ -165,6 +331,28 @@ class TimeLinedTable(BaseTable):
         super(TimeLinedTable, self).clean()
         self.history_check()
 
+    def get_lock_queryset(self) -> models.QuerySet:
+        """
+        Lock all records of the same unique key group(except start_date), including the one being written.
+        """
+        return self.__class__.objects.filter(**self.get_model_constraint_values)
+
+    def check_locked_records(self, records: list) -> None:
+        super(TimeLinedTable, self).check_locked_records(records)
+        self.history_check(records)
+
+    def close_older_record(self, updater: str, records: list = None):
+        """
+        Set the older record's end_date to this record's start_date - 1, unless it is already set.
+        """
+        older_record = self.older_record(records)
+        end_date = self.start_date - datetime.timedelta(days=1)
+        if older_record and self != older_record and older_record.end_date != end_date:
+            older_record.end_date = end_date
+            older_record.set_update_values(updater)
+            older_record.save()
+        return older_record
+
 class CodeCategory(BaseTable):
     codecategory = models.CharField(max_length=32, verbose_name=_('code category'))
     name = models.CharField(max_length=128, verbose_name=_('name'))
@@ -206,3 +394,119 @@ class CodeMaster(TimeLinedTable):
     
     def __str__(self):
         return self.name
+
+class CurrentCode(models.Model):
+    """
+    Denormalized copy of the CodeMaster record valid today, one per code category and code.
+    Maintained only if settings.COMMNDATA_CURRENT_CODES is True, see commndata.current.
+    """
+    codecategory = models.ForeignKey('CodeCategory', verbose_name=_('code category'), on_delete=models.CASCADE)
+    code = models.CharField(max_length=32, verbose_name=_('code'))
+    codemaster = models.OneToOneField('CodeMaster', verbose_name=_('code master'), on_delete=models.CASCADE, related_name='current')
+    name = models.CharField(max_length=128, verbose_name=_('name'))
+    value = models.CharField(max_length=128, verbose_name=_('value'), blank=True)
+    display_order = models.IntegerField(blank=True, null=True)
+    start_date = models.DateField(verbose_name = _('start_date'))
+    end_date = models.DateField(verbose_name = _('end_date'), blank = True, null = True)
+
+    class Meta:
+        verbose_name = _('current code')
+        verbose_name_plural = _('current code')
+        constraints = [
+            models.UniqueConstraint(name='currentcode_unique', fields = ['codecategory', 'code']),
+        ]
+        ordering = ['codecategory', 'display_order', 'code']
+
+    def __str__(self):
+        return self.name
+
+class CodeRelation(TimeLinedTable):
+    """
+    Parent of a code during a period, e.g. the region of a prefecture. Codes may belong to different code categories.
+    The paths between all ancestors and descendants are maintained in CodeClosure, see commndata.hierarchy.
+    """
+    parent_category = models.ForeignKey('CodeCategory', verbose_name=_('parent code category'), on_delete=models.RESTRICT, related_name='+')
+    parent_code = models.CharField(max_length=32, verbose_name=_('parent code'))
+    child_category = models.ForeignKey('CodeCategory', verbose_name=_('child code category'), on_delete=models.RESTRICT, related_name='+')
+    child_code = models.CharField(max_length=32, verbose_name=_('child code'))
+
+    class Meta:
+        verbose_name = _('code relation')
+        verbose_name_plural = _('code relation')
+        constraints = [
+            models.UniqueConstraint(name='coderelation_unique', fields = ['start_date', 'child_category', 'child_code']),
+        ]
+        ordering = ['parent_category', 'parent_code', 'child_category', 'child_code', '-start_date',]
+        permissions = [
+            ('import_coderelation', 'Can import Code Relation'),
+            ('export_coderelation', 'Can export Code Relation'),
+        ]
+
+    error_messages = {
+        **TimeLinedTable.error_messages,
+        'circular_relation': _(
+            '%(parent)s is a descendant of %(child)s, so it can not be the parent.'
+        ),
+    }
+
+    def circular_relation_check(self):
+        """
+        The parent must not be the child itself, or one of its descendants during this record's period.
+        """
+        try:
+            descendants = CodeClosure.objects.filter(ancestor_category_id=self.child_category_id, ancestor_code=self.child_code,
+                                                     descendant_category_id=self.parent_category_id, descendant_code=self.parent_code) \
+                            .filter(models.Q(end_date__isnull=True) | models.Q(end_date__gte=self.start_date))
+            if self.end_date:
+                descendants = descendants.filter(start_date__lte=self.end_date)
+
+            if (self.parent_category_id, self.parent_code) == (self.child_category_id, self.child_code) or descendants.exists():
+                raise ValidationError(
+                    self.error_messages['circular_relation'],
+                    code = 'circular_relation',
+                    params={'parent': self.parent_code, 'child': self.child_code}
+                )
+        except (ObjectDoesNotExist, ValueError, TypeError):
+            # This error should be already captured by other validations, so we ignore it here.
+            pass
+
+    def clean(self) -> None:
+        super(CodeRelation, self).clean()
+        self.circular_relation_check()
+
+    def __str__(self):
+        return '%s > %s' % (self.parent_code, self.child_code)
+
+class CodeClosure(models.Model):
+    """
+    A path from an ancestor code to a descendant code(depth >= 1), valid while all its CodeRelation records are.
+    Maintained by commndata.hierarchy, do not edit.
+    """
+    ancestor_category = models.ForeignKey('CodeCategory', on_delete=models.CASCADE, related_name='+')
+    ancestor_code = models.CharField(max_length=32)
+    descendant_category = models.ForeignKey('CodeCategory', on_delete=models.CASCADE, related_name='+')
+    descendant_code = models.CharField(max_length=32)
+    depth = models.PositiveSmallIntegerField()
+    start_date = models.DateField()
+    end_date = models.DateField(blank = True, null = True)
+
+    class Meta:
+        indexes = [
+            models.Index(name='codeclosure_ancestor', fields=['ancestor_category', 'ancestor_code', 'start_date']),
+            models.Index(name='codeclosure_descendant', fields=['descendant_category', 'descendant_code', 'start_date']),
+        ]
+
+class CodeSearchIndex(models.Model):
+    """
+    N-gram(1 and 2 characters) of CodeMaster's normalized code and name. Maintained by commndata.search, do not edit.
+    """
+    codemaster = models.ForeignKey('CodeMaster', on_delete=models.CASCADE, related_name='+')
+    codecategory = models.ForeignKey('CodeCategory', on_delete=models.CASCADE, related_name='+')
+    gram = models.CharField(max_length=2)
+    position = models.PositiveSmallIntegerField()   # first position of the gram in the text
+    length = models.PositiveSmallIntegerField()     # length of the text, shorter texts rank higher
+
+    class Meta:
+        indexes = [
+            models.Index(name='codesearchindex_gram', fields=['gram', 'codecategory']),
+        ]
@@ -0,0 +1,64 @@
+"""
+Join CodeMaster names and values to querysets of business tables in SQL.
+"""
+import datetime
+from functools import reduce
+from operator import or_
+
+from django.db.models import F, OuterRef, Q, QuerySet, Subquery
+
+from commndata.models import CodeMaster
+from commndata.resolvers import to_date
+
+def valid_on(as_of) -> Q:
+    """
+    Condition of the TimeLinedTable records valid on as_of(a date or an expression).
+    """
+    return Q(start_date__lte=as_of) & (Q(end_date__isnull=True) | Q(end_date__gte=as_of))
+
+def keys_condition(keys, category_field: str = 'codecategory_id', code_field: str = 'code') -> Q:
+    """
+    Condition of the (codecategory_id, code) keys, grouped by code category.
+    """
+    codes = {}
+    for codecategory_id, code in keys:
+        codes.setdefault(codecategory_id, set()).add(code)
+    return reduce(or_, (Q(**{category_field: c, '%s__in' % code_field: sorted(v)}) for c, v in codes.items()))
+
+def code_subquery(field: str, codecategory: str, as_of=None, column: str = 'name') -> Subquery:
+    """
+    Correlated subquery that selects a column of the CodeMaster record for the code stored in field.
+    as_of may be a date, a datetime, 'YYYY-MM-DD'(like the code_name tag and CodeResolver), an expression,
+    or F('field') for a date field of the outer model(default: today).
+    """
+    if as_of is None:
+        as_of = datetime.date.today()
+    elif isinstance(as_of, (str, datetime.date)):
+        try:
+            as_of = to_date(as_of)
+        except ValueError:
+            raise ValueError("as_of must be a date, 'YYYY-MM-DD' or F('field'), not %r." % as_of)
+    elif isinstance(as_of, F) and not isinstance(as_of, OuterRef):
+        as_of = OuterRef(as_of.name)
+
+    codes = CodeMaster.objects.filter(codecategory__codecategory=codecategory, code=OuterRef(field)) \
+                .filter(valid_on(as_of)) \
+                .order_by('-start_date') \
+                .values(column)[:1]
+    return Subquery(codes)
+
+def with_code_name(qs: QuerySet, field: str, category: str, as_of=None,
+                   columns=('name', 'value', 'display_order'), prefix: str = None) -> QuerySet:
+    """
+    Annotate qs with the CodeMaster columns of the code stored in field, so that sorting, filtering
+    and aggregation by code names happen in the database.
+
+        with_code_name(Customer.objects.all(), field='pref', category='pref').order_by('pref_name')
+        with_code_name(Customer.objects.all(), field='pref', category='pref', as_of=F('contract_date'))
+
+    The annotations are named <prefix>_<column>, where prefix defaults to field.
+    """
+    prefix = prefix or field
+    return qs.annotate(**{
+        '%s_%s' % (prefix, column): code_subquery(field, category, as_of, column) for column in columns
+    })
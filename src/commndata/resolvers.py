@@ -0,0 +1,144 @@
+"""
+Resolve code values stored in business tables to their CodeMaster names and values.
+"""
+import datetime
+from itertools import groupby, islice
+import threading
+import time
+
+from asgiref.local import Local
+from django.conf import settings
+
+from commndata import cache
+from commndata.cache import get_timeline
+
+_active = Local()
+_fallback = threading.local()
+
+def to_date(value):
+    """
+    A date from a date, a datetime or 'YYYY-MM-DD'. None for empty values.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
+
+class CodeResolver():
+    """
+    Batch resolver that loads every code category at most once during its lifetime.
+    Create one per request(see CodeResolverMiddleware) or per batch job, so that a list with thousands
+    of cells costs one cache lookup(or one query on a cache miss) per code category.
+    """
+    def __init__(self, as_of: datetime.date = None):
+        self.as_of = as_of
+        self.timelines = {}
+
+    def get_timeline(self, codecategory: str):
+        if codecategory not in self.timelines:
+            self.timelines[codecategory] = get_timeline(codecategory)
+        return self.timelines[codecategory]
+
+    def prefetch(self, *codecategories) -> None:
+        for codecategory in codecategories:
+            self.get_timeline(codecategory)
+
+    def get(self, codecategory: str, code, as_of: datetime.date = None):
+        """
+        Get the CodeEntry of the code valid on as_of(default: the resolver's as_of or today).
+        """
+        if code is None or code == '':
+            return None
+        return self.get_timeline(codecategory).get(str(code), as_of or self.as_of)
+
+    def name(self, codecategory: str, code, as_of: datetime.date = None, default=None):
+        entry = self.get(codecategory, code, as_of)
+        return entry.name if entry else default
+
+    def value(self, codecategory: str, code, as_of: datetime.date = None, default=None):
+        entry = self.get(codecategory, code, as_of)
+        return entry.value if entry else default
+
+    def resolve_many(self, triples, field: str = None, chunk_size: int = 10000):
+        """
+        Resolve (codecategory, code, as_of) triples in bulk, e.g. the transactions of a settlement job.
+        Yield the CodeEntry valid on each as_of(or its field, e.g. 'name'), None if there is none, in the order of the input.
+        The input is consumed chunk by chunk, so it can be a stream larger than memory.
+        """
+        triples = iter(triples)
+        while True:
+            chunk = list(islice(triples, chunk_size))
+            if not chunk:
+                return
+            for entry in self.resolve_chunk(chunk):
+                yield getattr(entry, field) if field and entry else entry
+
+    def resolve_columns(self, codecategories, codes, dates, field: str = None, chunk_size: int = 10000):
+        """
+        resolve_many() for columns of the same length, e.g. the columns of a dataframe.
+        """
+        return self.resolve_many(zip(codecategories, codes, dates), field, chunk_size)
+
+    def resolve_chunk(self, chunk: list) -> list:
+        """
+        Sort the chunk by code and date, and merge it with the sorted periods of each code in one pass.
+        Dates may be dates, datetimes or 'YYYY-MM-DD', like the as_of of the code_name tag.
+        """
+        default_date = to_date(self.as_of) or datetime.date.today()
+        rows = [
+            (codecategory, str(code), to_date(as_of) or default_date, i)
+            for i, (codecategory, code, as_of) in enumerate(chunk) if code is not None and code != ''
+        ]
+        rows.sort()
+
+        entries = [None] * len(chunk)
+        for (codecategory, code), group in groupby(rows, key=lambda row: row[:2]):
+            periods = self.get_timeline(codecategory).history(code)
+            if not periods:
+                continue
+            position = 0
+            for _, _, as_of, i in group:
+                # The period valid on as_of is the last one started on or before it.
+                while position + 1 < len(periods) and periods[position + 1].start_date <= as_of:
+                    position += 1
+                if periods[position].is_valid(as_of):
+                    entries[i] = periods[position]
+        return entries
+
+def activate(resolver: CodeResolver) -> None:
+    _active.value = resolver
+
+def deactivate() -> None:
+    if hasattr(_active, 'value'):
+        del _active.value
+
+def get_fallback_resolver() -> CodeResolver:
+    """
+    The resolver of this thread when none is active. It is reused while the codes are not changed:
+    writes in this process are noticed at once, writes in other processes(the cache generation)
+    within settings.COMMNDATA_RESOLVER_CHECK_INTERVAL seconds(default: 1).
+    """
+    resolver = getattr(_fallback, 'resolver', None)
+    now = time.monotonic()
+    if resolver is not None and _fallback.local_generation == cache.local_generation:
+        if now - _fallback.checked_at < getattr(settings, 'COMMNDATA_RESOLVER_CHECK_INTERVAL', 1):
+            return resolver
+        _fallback.checked_at = now
+        if _fallback.generation == cache.get_generation():
+            return resolver
+
+    _fallback.local_generation = cache.local_generation
+    _fallback.generation = cache.get_generation()
+    _fallback.checked_at = now
+    _fallback.resolver = CodeResolver()
+    return _fallback.resolver
+
+def get_resolver() -> CodeResolver:
+    """
+    Get the resolver of the current request, or the fallback resolver of this thread if no resolver is active.
+    """
+    resolver = getattr(_active, 'value', None)
+    return resolver if resolver is not None else get_fallback_resolver()
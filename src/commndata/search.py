@@ -0,0 +1,117 @@
+"""
+Search CodeMaster by code or name with an n-gram index.
+
+Texts are normalized for full-width/half-width characters, cases and katakana/hiragana, and split into
+1 and 2 character grams stored in CodeSearchIndex. A search looks up the grams of the term in the index,
+so it never scans CodeMaster, and ranks the matches by the position of the term(prefix matches first)
+and the length of the text.
+
+CodeSearchIndex is refreshed in the same transaction as CodeMaster's save(see commndata.signals),
+and rebuilt after CSV imports or by 'manage.py rebuild_search_index'.
+"""
+import datetime
+import unicodedata
+
+from django.db.models import Count, Max, Min, QuerySet
+
+from commndata.cache import get_codecategories
+from commndata.models import CodeMaster, CodeSearchIndex
+from commndata.query import valid_on
+
+def normalize_search_text(value) -> str:
+    """
+    Normalize full-width/half-width characters, cases and katakana to hiragana.
+    """
+    text = unicodedata.normalize('NFKC', str(value)).casefold()
+    return ''.join(chr(ord(c) - 0x60) if 'ァ' <= c <= 'ヶ' else c for c in text)
+
+def get_index_text(value) -> str:
+    """
+    Normalized text without spaces, to be split into grams.
+    """
+    return ''.join(normalize_search_text(value).split())
+
+def get_grams(text: str) -> dict:
+    """
+    Grams of a normalized text, with their first positions.
+    """
+    grams = {}
+    for n in (1, 2):
+        for position in range(len(text) - n + 1):
+            grams.setdefault(text[position:position + n], position)
+    return grams
+
+def get_search_grams(term: str) -> list:
+    """
+    Grams to look up for a search term: the characters of a 1 character term, or the 2 character grams.
+    """
+    text = get_index_text(term)
+    return sorted({text[i:i + 2] for i in range(len(text) - 1)} or set(text))
+
+def get_index_texts(codemaster) -> list:
+    return [codemaster.name, codemaster.code]
+
+def index_codemasters(codemasters, using: str = None) -> int:
+    """
+    Replace the index of the codemasters. Call this in the transaction that writes CodeMaster.
+    """
+    codemasters = list(codemasters)
+    CodeSearchIndex.objects.using(using).filter(codemaster__in=[m.pk for m in codemasters]).delete()
+
+    rows = []
+    for codemaster in codemasters:
+        grams = {}
+        texts = [get_index_text(text) for text in get_index_texts(codemaster) if text]
+        for text in texts:
+            for gram, position in get_grams(text).items():
+                grams[gram] = min(grams.get(gram, position), position)
+        length = min(max(map(len, texts), default=0), 32767)
+        rows.extend(
+            CodeSearchIndex(codemaster_id=codemaster.pk, codecategory_id=codemaster.codecategory_id,
+                            gram=gram, position=min(position, 32767), length=length)
+            for gram, position in grams.items()
+        )
+    CodeSearchIndex.objects.using(using).bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+def rebuild_search_index(using: str = None, chunk_size: int = 2000) -> int:
+    CodeSearchIndex.objects.using(using).all().delete()
+    codemasters = CodeMaster.objects.using(using).order_by('pk').only('pk', 'codecategory_id', 'code', 'name')
+    count = 0
+    chunk = []
+    for codemaster in codemasters.iterator(chunk_size=chunk_size):
+        chunk.append(codemaster)
+        if len(chunk) >= chunk_size:
+            count += index_codemasters(chunk, using)
+            chunk = []
+    return count + index_codemasters(chunk, using)
+
+def search_ids(term: str, codecategory_ids=None, using: str = None) -> QuerySet:
+    """
+    Ids of the CodeMaster records containing every gram of term, with their ranks(hits, first, length), best first.
+    """
+    grams = get_search_grams(term)
+    index = CodeSearchIndex.objects.using(using).filter(gram__in=grams)
+    if codecategory_ids is not None:
+        index = index.filter(codecategory_id__in=codecategory_ids)
+    return index.values('codemaster_id') \
+                .annotate(hits=Count('gram', distinct=True), first=Min('position'), text_length=Max('length')) \
+                .filter(hits=len(grams)) \
+                .order_by('first', 'text_length', 'codemaster_id')
+
+def search(term: str, codecategory: str = None, as_of: datetime.date = None, limit: int = 20, using: str = None) -> list:
+    """
+    CodeMaster records matching term, in the order of their ranks. With as_of, only the records valid on it.
+    limit None returns all matches.
+    """
+    if not get_search_grams(term):
+        return []
+
+    codecategory_ids = [pk for pk, c, name in get_codecategories() if c == codecategory] if codecategory else None
+    ranked = search_ids(term, codecategory_ids, using)
+    if as_of:
+        ranked = ranked.filter(codemaster_id__in=CodeMaster.objects.using(using).filter(valid_on(as_of)).values('pk'))
+
+    ids = [row['codemaster_id'] for row in (ranked[:limit] if limit is not None else ranked)]
+    found = CodeMaster.objects.using(using).select_related('codecategory').in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
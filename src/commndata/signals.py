@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission, PermissionsMixin
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from commndata import current, hierarchy, search
+from commndata.cache import invalidate_codes_on_commit, invalidate_model_on_commit, invalidate_permissions_on_commit
+from commndata.models import BaseTable, CodeCategory, CodeMaster, CodeRelation
+
+@receiver(post_save, sender=CodeCategory)
+@receiver(post_delete, sender=CodeCategory)
+@receiver(post_save, sender=CodeMaster)
+@receiver(post_delete, sender=CodeMaster)
+def code_changed(sender, using=None, **kwargs):
+    invalidate_codes_on_commit(using)
+
+@receiver(post_save, sender=CodeMaster)
+@receiver(post_delete, sender=CodeMaster)
+def refresh_current_code(sender, instance, using=None, **kwargs):
+    if current.is_enabled():
+        current.refresh_current_codes([(instance.codecategory_id, instance.code)], using=using)
+
+@receiver(post_save, sender=CodeMaster)
+def index_code(sender, instance, using=None, **kwargs):
+    search.index_codemasters([instance], using=using)
+
+@receiver(post_save, sender=CodeRelation)
+@receiver(post_delete, sender=CodeRelation)
+def refresh_code_closure(sender, instance, using=None, **kwargs):
+    hierarchy.refresh_code_closure([(instance.child_category_id, instance.child_code)], using=using)
+
+@receiver(post_save)
+@receiver(post_delete)
+def base_table_changed(sender, using=None, **kwargs):
+    if issubclass(sender, BaseTable):
+        invalidate_model_on_commit(sender, using)
+
+def bulk_written(model, objs: list, using=None) -> None:
+    """
+    What the receivers above do on save, for the records written by BaseTableQuerySet.bulk_create or bulk_update.
+    """
+    if not objs:
+        return
+
+    invalidate_model_on_commit(model, using)
+    if issubclass(model, (CodeCategory, CodeMaster)):
+        invalidate_codes_on_commit(using)
+    if issubclass(model, CodeMaster):
+        search.index_codemasters(objs, using=using)
+        if current.is_enabled():
+            current.refresh_current_codes({(obj.codecategory_id, obj.code) for obj in objs}, using=using)
+    if issubclass(model, CodeRelation):
+        hierarchy.refresh_code_closure({(obj.child_category_id, obj.child_code) for obj in objs}, using=using)
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def permissions_changed(sender, using=None, **kwargs):
+    invalidate_permissions_on_commit(using)
+
+User = get_user_model()
+if issubclass(User, PermissionsMixin):
+    m2m_changed.connect(permissions_changed, sender=User.groups.through)
+    m2m_changed.connect(permissions_changed, sender=User.user_permissions.through)
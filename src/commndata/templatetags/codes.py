@@ -0,0 +1,40 @@
+"""
+Display code values as their CodeMaster names.
+
+    {% load codes %}
+    {{ obj.pref|codename:"pref" }}
+    {{ obj.pref|codevalue:"pref" }}
+    {% code_name obj.pref "pref" as_of=obj.contract_date %}
+
+The filters resolve as of today, the tag honors an as_of date(date, datetime or 'YYYY-MM-DD').
+Codes are resolved with the request-scoped resolver activated by CodeResolverMiddleware, so each
+code category is looked up once per request(without it, by the resolver of the thread, see get_fallback_resolver).
+Unknown codes are displayed as they are.
+"""
+from django import template
+
+from commndata.resolvers import CodeResolver, get_resolver, to_date
+
+register = template.Library()
+
+def get_context_resolver(context):
+    """
+    Use the request-scoped resolver if any, or share one resolver during this rendering.
+    """
+    request = context.get('request')
+    if request is not None and hasattr(request, 'code_resolver'):
+        return request.code_resolver
+    return context.render_context.setdefault(CodeResolver, CodeResolver())
+
+@register.filter
+def codename(code, codecategory):
+    return get_resolver().name(codecategory, code, default=code)
+
+@register.filter
+def codevalue(code, codecategory):
+    return get_resolver().value(codecategory, code, default=code)
+
+@register.simple_tag(takes_context=True)
+def code_name(context, code, codecategory, as_of=None, field='name'):
+    entry = get_context_resolver(context).get(codecategory, code, to_date(as_of))
+    return getattr(entry, field) if entry else code
@@ -0,0 +1,211 @@
+"""
+Helpers for the tests of apps built on BaseTable and TimeLinedTable.
+
+Factories create valid records in bulk, with the audit fields and the end_date chains set as the admin would,
+in a few statements and without save() and the queries of its clean():
+
+    create_codecategories('pref', {'codecategory': 'region', 'name': 'Region'})
+    create_codes('pref', {'13': 'Tokyo', '14': [(date(2000, 1, 1), 'Kanagawa'), (date(2020, 4, 1), {'name': 'New Kanagawa'})]})
+
+A seeded SQLite test database is built once into a template file(by the migrations and a seed function),
+and later test runs restore it into the test database, cloned per worker, instead of migrating and seeding again:
+
+    TEST_RUNNER = 'commndata.testing.TemplateDatabaseRunner'    # settings, with COMMNDATA_TEST_SEED = 'myapp.tests.seed'
+    django_db_setup = template_db_setup_fixture(seed)           # conftest.py, with pytest-django
+
+The template is rebuilt when a migration file or the source of the seed function changes. It is kept in
+settings.COMMNDATA_TEST_TEMPLATE_DIR(default: the temporary directory).
+"""
+import datetime
+import hashlib
+import inspect
+import os
+import sqlite3
+import sys
+import tempfile
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.test.runner import DiscoverRunner
+from django.utils.module_loading import import_string
+
+from commndata.models import CodeCategory, CodeMaster
+
+DEFAULT_START_DATE = datetime.date(2000, 1, 1)
+
+def create_records(model, objs, username: str = 'test', using: str = None) -> list:
+    """
+    Bulk create BaseTable records with their audit fields(BaseTableQuerySet refreshes the derived tables).
+    """
+    objs = list(objs)
+    init_values = model.get_init_values(username)
+    for obj in objs:
+        for k, v in init_values.items():
+            setattr(obj, k, v)
+    return model.objects.using(using).bulk_create(objs)
+
+def chain_periods(periods) -> list:
+    """
+    Sort the periods(unsaved TimeLinedTable records of one key) by start_date, and end each one the day before the next.
+    """
+    periods = sorted(periods, key=lambda p: p.start_date)
+    for older, newer in zip(periods, periods[1:]):
+        older.end_date = newer.start_date - datetime.timedelta(days=1)
+    return periods
+
+def create_codecategories(*codecategories, username: str = 'test', using: str = None) -> dict:
+    """
+    Create code categories given by codecategory or by dicts of field values, and return them by codecategory.
+    """
+    objs = []
+    for display_order, values in enumerate(codecategories, 1):
+        values = values if isinstance(values, dict) else {'codecategory': values}
+        objs.append(CodeCategory(**{'name': values['codecategory'], 'display_order': display_order, **values}))
+    return {obj.codecategory: obj for obj in create_records(CodeCategory, objs, username, using)}
+
+def create_codes(codecategory, codes: dict, start_date: datetime.date = DEFAULT_START_DATE,
+                 username: str = 'test', using: str = None) -> list:
+    """
+    Create the CodeMaster timelines of a code category(a CodeCategory, or its codecategory, created if missing).
+    codes maps each code to a name, a dict of field values, or a list of (start_date, name or dict of field values).
+    """
+    if not isinstance(codecategory, CodeCategory):
+        codecategory = CodeCategory.objects.using(using).filter(codecategory=codecategory).first() \
+                       or create_codecategories(codecategory, username=username, using=using)[codecategory]
+
+    objs = []
+    for display_order, (code, periods) in enumerate(codes.items(), 1):
+        if not isinstance(periods, list):
+            periods = [(start_date, periods)]
+        objs.extend(chain_periods(
+            CodeMaster(**{'codecategory': codecategory, 'code': code, 'value': code, 'display_order': display_order,
+                          'start_date': period_start, **(values if isinstance(values, dict) else {'name': values})})
+            for period_start, values in periods
+        ))
+    return create_records(CodeMaster, objs, username, using)
+
+def get_template_path(alias: str, seed=None) -> str:
+    """
+    Path of the template database of alias, named after the contents of the migration files and the source of seed.
+    """
+    digest = hashlib.sha256(alias.encode('utf-8'))
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    for key, migration in sorted(loader.disk_migrations.items()):
+        digest.update(repr(key).encode('utf-8'))
+        with open(sys.modules[migration.__module__].__file__, 'rb') as file:
+            digest.update(file.read())
+    if seed is not None:
+        try:
+            digest.update(inspect.getsource(seed).encode('utf-8'))
+        except (OSError, TypeError):
+            digest.update(('%s.%s' % (seed.__module__, seed.__qualname__)).encode('utf-8'))
+    directory = getattr(settings, 'COMMNDATA_TEST_TEMPLATE_DIR', None) or tempfile.gettempdir()
+    return os.path.join(directory, 'commndata_template_%s.sqlite3' % digest.hexdigest()[:16])
+
+def build_template(connection, path: str, seed=None, verbosity: int = 1) -> str:
+    """
+    Create the test database with the migrations and seed, and save it to path. Returns the old database name.
+    """
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    if seed is not None:
+        with transaction.atomic(using=connection.alias):
+            seed(using=connection.alias)
+
+    # Written to a temporary file first, so that parallel test processes never read a half written template.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = '%s.%s' % (path, os.getpid())
+    template = sqlite3.connect(temporary_path)
+    try:
+        connection.ensure_connection()
+        connection.connection.backup(template)
+    finally:
+        template.close()
+    os.replace(temporary_path, path)
+    return old_name
+
+def restore_template(connection, path: str, verbosity: int = 1) -> str:
+    """
+    Create the test database from the template at path, in place of create_test_db(). Returns the old database name.
+    """
+    creation = connection.creation
+    old_name = connection.settings_dict['NAME']
+    test_name = creation._get_test_db_name()
+    if verbosity >= 1:
+        creation.log('Restoring test database for alias %s from %s...' % (
+            creation._get_database_display_str(verbosity, test_name), path))
+    connection.close()
+    if not creation.is_in_memory_db(test_name) and os.path.exists(test_name):
+        os.remove(test_name)
+
+    settings.DATABASES[connection.alias]['NAME'] = test_name
+    connection.settings_dict['NAME'] = test_name
+    template = sqlite3.connect(path)
+    try:
+        connection.ensure_connection()
+        template.backup(connection.connection)
+    finally:
+        template.close()
+    return old_name
+
+def setup_template_databases(aliases=None, seed=None, verbosity: int = 1, parallel: int = 0, serialized_aliases=()) -> list:
+    """
+    Create the test databases of aliases(default: all), from a template for SQLite, and their clones for parallel workers.
+    Only the serialized_aliases are serialized for serialized_rollback.
+    Returns the old_config for django.test.utils.teardown_databases().
+    Mirrors(TEST['MIRROR']) are not supported.
+    """
+    old_config = []
+    for alias in aliases or connections:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+            if seed is not None:
+                with transaction.atomic(using=alias):
+                    seed(using=alias)
+        else:
+            path = get_template_path(alias, seed)
+            if os.path.exists(path):
+                old_name = restore_template(connection, path, verbosity)
+            else:
+                old_name = build_template(connection, path, seed, verbosity)
+
+        if alias in (serialized_aliases or ()):
+            connection._test_serialized_contents = connection.creation.serialize_db_to_string()
+        for index in range(parallel if parallel > 1 else 0):
+            connection.creation.clone_test_db(suffix=str(index + 1), verbosity=verbosity, keepdb=False)
+        old_config.append((connection, old_name, True))
+    return old_config
+
+def get_seed():
+    """
+    The seed function named by settings.COMMNDATA_TEST_SEED, called with the database alias as using.
+    """
+    seed = getattr(settings, 'COMMNDATA_TEST_SEED', None)
+    return import_string(seed) if isinstance(seed, str) else seed
+
+class TemplateDatabaseRunner(DiscoverRunner):
+    """
+    DiscoverRunner with the test databases restored from a seeded template, see setup_template_databases().
+    """
+    def setup_databases(self, **kwargs):
+        return setup_template_databases(kwargs.get('aliases'), get_seed(), self.verbosity, self.parallel,
+                                        kwargs.get('serialized_aliases'))
+
+def template_db_setup_fixture(seed=None):
+    """
+    A session fixture to override pytest-django's django_db_setup in conftest.py. With pytest-xdist,
+    every worker restores its own test database(named with the worker id by pytest-django) from the same template.
+    """
+    import pytest
+    from django.test.utils import teardown_databases
+
+    @pytest.fixture(scope='session')
+    def django_db_setup(django_test_environment, django_db_blocker, django_db_modify_db_settings):
+        with django_db_blocker.unblock():
+            old_config = setup_template_databases(seed=seed or get_seed(), verbosity=0)
+        yield
+        with django_db_blocker.unblock():
+            teardown_databases(old_config, verbosity=0)
+
+    return django_db_setup
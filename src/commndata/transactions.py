@@ -0,0 +1,54 @@
+"""
+Run writes in a transaction, retrying them when they conflict with concurrent writers.
+"""
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE of serialization_failure, deadlock_detected and lock_not_available
+RETRYABLE_SQLSTATES = ('40001', '40P01', '55P03')
+# MySQL's ER_LOCK_WAIT_TIMEOUT and ER_LOCK_DEADLOCK
+RETRYABLE_MYSQL_ERRORS = (1205, 1213)
+RETRYABLE_MESSAGES = ('database is locked', 'could not obtain lock', 'deadlock', 'could not serialize')
+
+def is_write_conflict(error: DatabaseError) -> bool:
+    """
+    Whether the error is caused by a lock conflict or a serialization failure, which succeeds on retry.
+    """
+    cause = error.__cause__ or error
+    if getattr(cause, 'pgcode', None) in RETRYABLE_SQLSTATES or getattr(cause, 'sqlstate', None) in RETRYABLE_SQLSTATES:
+        return True
+    if cause.args and cause.args[0] in RETRYABLE_MYSQL_ERRORS:
+        return True
+    message = str(error).lower()
+    return any(m in message for m in RETRYABLE_MESSAGES)
+
+def atomic_with_retry(func, using=None, attempts: int = None, backoff: float = None):
+    """
+    Call func in transaction.atomic(using), and retry it with an exponential backoff on a write conflict.
+    func must be idempotent: all its changes are rolled back before the next attempt.
+    When called inside a transaction, func is called once in a savepoint: a retry in the same transaction keeps
+    its locks and its snapshot, and fails again, so the conflict is left to the caller that owns the transaction.
+    """
+    if transaction.get_connection(using).in_atomic_block:
+        with transaction.atomic(using=using):
+            return func()
+
+    attempts = attempts or getattr(settings, 'COMMNDATA_WRITE_ATTEMPTS', 3)
+    backoff = backoff if backoff is not None else getattr(settings, 'COMMNDATA_WRITE_BACKOFF', 0.05)
+
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic(using=using):
+                return func()
+        except DatabaseError as e:
+            if attempt >= attempts or not is_write_conflict(e):
+                raise
+            delay = backoff * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.info('Write conflict(%s), retry %d/%d after %.3fs.', e, attempt, attempts - 1, delay)
+            time.sleep(delay)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from commndata.views import CodeSearchView
+
+app_name = 'commndata'
+
+urlpatterns = [
+    path('codes/search/', CodeSearchView.as_view(), name='code_search'),
+]
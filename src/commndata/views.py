@@ -1,7 +1,18 @@
+from bisect import bisect_left
+import datetime
+
 from django import forms
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.admin.views.autocomplete import AutocompleteJsonView
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.http import JsonResponse
 from django.utils.translation import gettext_lazy as _
+from django.views.generic import View
 from django.views.generic.edit import FormView
 
+from commndata.search import normalize_search_text, search
+
 
 class UploadView(FormView):
     class UploadForm(forms.Form):
@@ -13,4 +24,88 @@ class UploadView(FormView):
     form_class = UploadForm
     template_name = "commndata/upload.html"
 
+class AutocompleteIndex():
+    """
+    Prefix index of the autocomplete results of a model, small enough to be cached as a whole.
+    Objects are indexed by their str() and the values of the search fields on the model itself(no lookups across relations),
+    as a whole and word by word.
+    """
+    def __init__(self, entries: list, keys: list):
+        self.entries = entries  # (id, text) in the order of the ModelAdmin's queryset
+        self.keys = keys        # sorted (normalized text, index of entries)
+
+    @classmethod
+    def build(cls, queryset, to_field_name: str, search_fields):
+        fields = [f.lstrip('^=@') for f in search_fields if '__' not in f.lstrip('^=@')]
+        entries, keys = [], []
+        for position, obj in enumerate(queryset):
+            entries.append((str(getattr(obj, to_field_name)), str(obj)))
+            for value in {str(obj), *(getattr(obj, f) for f in fields)}:
+                if value is None or value == '':
+                    continue
+                text = normalize_search_text(value)
+                keys.extend((key, position) for key in {text, *text.split()})
+        return cls(entries, sorted(keys))
+
+    def search_word(self, word: str) -> set:
+        positions = set()
+        index = bisect_left(self.keys, (word,))
+        while index < len(self.keys) and self.keys[index][0].startswith(word):
+            positions.add(self.keys[index][1])
+            index += 1
+        return positions
+
+    def search(self, term: str) -> list:
+        """
+        Entries having a prefix match for every word in term.
+        """
+        words = normalize_search_text(term).split()
+        if not words:
+            return self.entries
+        positions = set.intersection(*(self.search_word(word) for word in words))
+        return [self.entries[p] for p in sorted(positions)]
+
+class CachedAutocompleteJsonView(AutocompleteJsonView):
+    """
+    AutocompleteJsonView answering from the AutocompleteIndex cached by BaseTableAdminMixin.
+    """
+    def get(self, request, *args, **kwargs):
+        self.term, self.model_admin, self.source_field, to_field_name = self.process_request(request)
+
+        if not self.has_perm(request):
+            raise PermissionDenied
+
+        if self.source_field.get_limit_choices_to() or not hasattr(self.model_admin, 'get_autocomplete_index'):
+            return super(CachedAutocompleteJsonView, self).get(request, *args, **kwargs)
+
+        results = self.model_admin.get_autocomplete_index(request, to_field_name).search(self.term)
+        page = Paginator(results, self.paginate_by).get_page(request.GET.get('page'))
+        return JsonResponse({
+            'results': [{'id': id, 'text': text} for id, text in page],
+            'pagination': {'more': page.has_next()},
+        })
+
+class CodeSearchView(LoginRequiredMixin, View):
+    """
+    Search codes by code or name: ?q=<term>[&category=<code category>][&as_of=YYYY-MM-DD][&limit=20]
+    """
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            as_of = datetime.date.fromisoformat(request.GET['as_of']) if request.GET.get('as_of') else None
+            limit = int(request.GET.get('limit', 20))
+            if limit < 1:
+                raise ValueError('limit must be positive')
+        except ValueError:
+            return JsonResponse({'error': 'invalid parameter'}, status=400)
 
+        codemasters = search(request.GET.get('q', ''), request.GET.get('category'), as_of, min(limit, self.max_limit))
+        return JsonResponse({
+            'results': [
+                {
+                    'codecategory': m.codecategory.codecategory, 'code': m.code, 'name': m.name, 'value': m.value,
+                    'start_date': m.start_date, 'end_date': m.end_date,
+                } for m in codemasters
+            ],
+        })
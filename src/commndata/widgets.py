@@ -0,0 +1,10 @@
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.urls import reverse
+
+class CachedAutocompleteSelect(AutocompleteSelect):
+    """
+    AutocompleteSelect requesting the cached autocomplete endpoint of the related BaseTableAdminMixin.
+    """
+    def get_url(self):
+        opts = self.field.remote_field.model._meta
+        return reverse('%s:%s_%s_autocomplete' % (self.admin_site.name, opts.app_label, opts.model_name))
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+"""
+Load test of the optimistic locking and the timeline writes with many concurrent editors.
+
+    python loadtest.py --workers 8 --duration 10
+    python loadtest.py --workers 4 --processes --hot 0.8 --think 20
+    DJANGO_SETTINGS_MODULE=mysite.settings python loadtest.py   (run against the database of a project)
+
+Every worker repeatedly reads a code, edits the latest record of a code, or inserts a new period of a code
+by posting the change and add forms to the admin views of TimeLinedTableAdminMixin, the same way as editors do:
+the request transaction, the form validation with the locks and the retries are all exercised.
+A share of the operations(--hot) targets the same code, the others are spread over --keys codes.
+
+Afterwards it reports the throughput, the latency percentiles, the conflicts and the retries,
+and verifies that every timeline is still a chain of end_date = next start_date - 1,
+that no update was lost(the versions add up to the number of successful writes),
+and that no write failed with a database error after the retries.
+"""
+import argparse
+from collections import Counter, defaultdict
+import datetime
+from itertools import groupby
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+import django
+from django.conf import settings
+
+CATEGORY = 'loadtest'
+
+# The admin site of the load test, and the urls to it(ROOT_URLCONF of the load test).
+site = None
+urlpatterns = []
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent editors')
+    parser.add_argument('--processes', action='store_true', help='run the editors as processes instead of threads')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--keys', type=int, default=8, help='number of codes')
+    parser.add_argument('--hot', type=float, default=0.5, help='share of the operations on the same code')
+    parser.add_argument('--reads', type=float, default=0.6, help='share of reads')
+    parser.add_argument('--inserts', type=float, default=0.1, help='share of new periods, the rest are edits')
+    parser.add_argument('--think', type=float, default=5, help='milliseconds between loading and saving a record')
+    parser.add_argument('--attempts', type=int, default=3, help='settings.COMMNDATA_WRITE_ATTEMPTS')
+    parser.add_argument('--lock-timeout', type=float, default=1, help='seconds SQLite waits for a lock')
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'commndata_loadtest.sqlite3'),
+                        help='SQLite database file')
+    return parser.parse_args()
+
+def configure(options):
+    if not os.environ.get('DJANGO_SETTINGS_MODULE'):
+        settings.configure(
+            SECRET_KEY='loadtest',
+            INSTALLED_APPS=[
+                'commndata',
+                'django.contrib.admin',
+                'django.contrib.auth',
+                'django.contrib.contenttypes',
+                'django.contrib.messages',
+                'django.contrib.sessions',
+            ],
+            DATABASES={
+                'default': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': options.db,
+                    'OPTIONS': {'timeout': options.lock_timeout},
+                },
+            },
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            USE_TZ=True,
+            DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+            ROOT_URLCONF=__name__,
+            COMMNDATA_WRITE_ATTEMPTS=options.attempts,
+        )
+    django.setup()
+
+class RetryCounter(logging.Handler):
+    """
+    Count the retries logged by commndata.transactions.atomic_with_retry.
+    """
+    def __init__(self):
+        super(RetryCounter, self).__init__(logging.INFO)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+retry_counter = RetryCounter()
+
+def prepare(options):
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from commndata.models import CodeCategory, CodeMaster
+
+    call_command('migrate', verbosity=0)
+    for worker in range(options.workers):
+        get_user_model().objects.update_or_create(
+            username='loadtest%d' % worker, defaults={'is_active': True, 'is_staff': True, 'is_superuser': True})
+    CodeMaster.objects.filter(codecategory__codecategory=CATEGORY).delete()
+    CodeCategory.objects.filter(codecategory=CATEGORY).delete()
+
+    init_values = CodeCategory.get_init_values('loadtest')
+    category = CodeCategory.objects.create(codecategory=CATEGORY, name='load test', **init_values)
+    CodeMaster.objects.bulk_create([
+        CodeMaster(codecategory=category, code='%03d' % i, name='code %03d' % i,
+                   start_date=datetime.date(2000, 1, 1), **init_values)
+        for i in range(options.keys)
+    ])
+
+def get_model_admin():
+    """
+    Register CodeMaster on the admin site of the load test, once before the workers start.
+    """
+    global site
+    from django.contrib import admin
+    from django.urls import path
+    from commndata.admin import TimeLinedTableAdminMixin
+    from commndata.models import CodeMaster
+
+    if site is None:
+        class LoadTestAdmin(TimeLinedTableAdminMixin, admin.ModelAdmin):
+            pass
+
+        site = admin.AdminSite(name='loadtest')
+        site.register(CodeMaster, LoadTestAdmin)
+        urlpatterns.append(path('loadtest/', site.urls))
+    return site._registry[CodeMaster]
+
+def get_form_data(form) -> dict:
+    """
+    The data a browser posts for an unbound form.
+    """
+    from django.forms import MultiWidget
+
+    data = {}
+    for name, field in form.fields.items():
+        value = form[name].value()
+        if isinstance(field.widget, MultiWidget):
+            for i, v in enumerate(field.widget.decompress(value)):
+                data['%s_%d' % (name, i)] = '' if v is None else str(v)
+        elif value is not None:
+            data[name] = str(value)
+    return data
+
+class ConflictError(Exception):
+    """
+    The form was rejected because of other editors' changes.
+    """
+
+def run_worker(worker: int, options) -> dict:
+    """
+    Run operations until the deadline, and return the latencies and the outcomes.
+    """
+    from django.contrib.auth import get_user_model
+    from django.contrib.messages.storage.cookie import CookieStorage
+    from django.core.exceptions import PermissionDenied
+    from django.db import DatabaseError, IntegrityError, connection
+    from django.test import RequestFactory
+    from django.urls import set_urlconf
+    from commndata.models import CodeCategory, CodeMaster
+    from commndata.query import valid_on
+
+    # The urls of the load test site, also when a project's settings are used.
+    set_urlconf(__name__)
+    rng = random.Random(worker)
+    model_admin = get_model_admin()
+    factory = RequestFactory()
+    user = get_user_model().objects.get(username='loadtest%d' % worker)
+    category = CodeCategory.objects.get(codecategory=CATEGORY)
+    latencies = defaultdict(list)
+    outcomes = Counter()
+
+    def latest(code):
+        return CodeMaster.objects.filter(codecategory=category, code=code).order_by('-start_date').first()
+
+    def think():
+        time.sleep(options.think / 1000 * rng.random() * 2)
+
+    def read(code):
+        CodeMaster.objects.filter(codecategory=category, code=code).filter(valid_on(datetime.date.today())).first()
+
+    def get_request(path, data=None):
+        request = factory.post(path, data) if data is not None else factory.get(path)
+        request.user = user
+        request._dont_enforce_csrf_checks = True
+        request._messages = CookieStorage(request)
+        return request
+
+    def load_form(path, obj=None) -> dict:
+        request = get_request(path)
+        return get_form_data(model_admin.get_form(request, obj)(instance=obj))
+
+    def submit(view, path, data, *args):
+        """
+        Post the form, and tell whether it was saved(redirected) or rejected(shown again with errors).
+        """
+        try:
+            response = view(get_request(path, data), *args)
+        except PermissionDenied:
+            # Another editor added a newer period meanwhile, so the record is not editable any more.
+            raise ConflictError()
+        if response.status_code != 302:
+            raise ConflictError()
+
+    def edit(code):
+        obj = latest(code)
+        path = '/loadtest/commndata/codemaster/%s/change/' % obj.pk
+        data = load_form(path, obj)
+        think()
+        data['name'] = 'code %s by %s' % (code, user.username)
+        submit(model_admin.change_view, path, data, str(obj.pk))
+
+    def insert(code):
+        older = latest(code)
+        path = '/loadtest/commndata/codemaster/add/'
+        data = load_form(path)
+        think()
+        data.update(codecategory=str(category.pk), code=code, name='code %s from %s' % (code, user.username),
+                    start_date=str(older.start_date + datetime.timedelta(days=rng.randint(1, 30))))
+        submit(model_admin.add_view, path, data)
+
+    deadline = time.monotonic() + options.duration
+    try:
+        while time.monotonic() < deadline:
+            code = '000' if rng.random() < options.hot else '%03d' % rng.randrange(options.keys)
+            dice = rng.random()
+            operation = read if dice < options.reads else insert if dice < options.reads + options.inserts else edit
+            started = time.perf_counter()
+            try:
+                operation(code)
+                outcome = 'ok'
+            except (ConflictError, IntegrityError):
+                outcome = 'conflict'
+            except DatabaseError:
+                outcome = 'failed'
+            latencies[operation.__name__].append(time.perf_counter() - started)
+            outcomes[operation.__name__, outcome] += 1
+    finally:
+        connection.close()
+
+    return {'latencies': dict(latencies), 'outcomes': outcomes}
+
+def run_process(worker: int, options, queue):
+    result = run_worker(worker, options)
+    # The retries in this process are counted in its own copy of retry_counter.
+    result['retries'] = retry_counter.count
+    queue.put(result)
+
+def run_workers(options) -> list:
+    if not options.processes:
+        results = [None] * options.workers
+
+        def run(worker):
+            results[worker] = run_worker(worker, options)
+
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in range(options.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    from django.db import connections
+
+    # Forked processes must not share the parent's database connection.
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    processes = [context.Process(target=run_process, args=(worker, options, queue)) for worker in range(options.workers)]
+    for process in processes:
+        process.start()
+    results = [queue.get() for process in processes]
+    for process in processes:
+        process.join()
+    return results
+
+def verify() -> list:
+    """
+    Check the end_date chain of every code, and return the problems found.
+    """
+    from commndata.models import CodeMaster
+
+    problems = []
+    records = CodeMaster.objects.filter(codecategory__codecategory=CATEGORY).order_by('code', 'start_date')
+    for code, timeline in groupby(records, key=lambda r: r.code):
+        timeline = list(timeline)
+        for older, newer in zip(timeline, timeline[1:]):
+            if older.end_date != newer.start_date - datetime.timedelta(days=1):
+                problems.append('%s: %s-%s is followed by %s-' % (code, older.start_date, older.end_date, newer.start_date))
+        if timeline[-1].end_date is not None:
+            problems.append('%s: the latest record %s-%s is closed' % (code, timeline[-1].start_date, timeline[-1].end_date))
+    return problems
+
+def count_versions() -> int:
+    from commndata.models import CodeMaster
+
+    return sum(v - 1 for v in CodeMaster.objects.filter(codecategory__codecategory=CATEGORY).values_list('version', flat=True))
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def report(options, results: list, elapsed: float):
+    latencies = defaultdict(list)
+    outcomes = Counter()
+    for result in results:
+        for operation, values in result['latencies'].items():
+            latencies[operation].extend(values)
+        outcomes.update(result['outcomes'])
+
+    total = sum(outcomes.values())
+    print('%d %s, %.1f seconds, %d operations, %.1f operations/second' % (
+        options.workers, 'processes' if options.processes else 'threads', elapsed, total, total / elapsed))
+    print('%-8s %8s %8s %8s %8s %8s %8s %8s' % ('', 'ok', 'conflict', 'failed', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'max(ms)'))
+    for operation in ('read', 'edit', 'insert'):
+        values = sorted(latencies[operation])
+        if not values:
+            continue
+        print('%-8s %8d %8d %8d %8.1f %8.1f %8.1f %8.1f' % (
+            operation, outcomes[operation, 'ok'], outcomes[operation, 'conflict'], outcomes[operation, 'failed'],
+            *(percentile(values, p) * 1000 for p in (0.5, 0.95, 0.99)), values[-1] * 1000))
+    retries = sum(result['retries'] for result in results) if options.processes else retry_counter.count
+    print('retries on write conflicts: %d' % retries)
+
+    problems = verify()
+    writes = outcomes['edit', 'ok'] + outcomes['insert', 'ok']
+    versions = count_versions()
+    if versions != writes:
+        problems.append('versions were incremented %d times for %d successful writes' % (versions, writes))
+    failed = outcomes['edit', 'failed'] + outcomes['insert', 'failed']
+    if failed:
+        problems.append('%d writes failed with a database error after the retries' % failed)
+    for problem in problems:
+        print('NG: %s' % problem)
+    print('timeline integrity: %s' % ('NG' if problems else 'OK'))
+    return not problems
+
+def main():
+    options = parse_args()
+    configure(options)
+
+    transactions_logger = logging.getLogger('commndata.transactions')
+    transactions_logger.addHandler(retry_counter)
+    transactions_logger.setLevel(logging.INFO)
+    transactions_logger.propagate = False
+
+    prepare(options)
+    get_model_admin()
+    started = time.monotonic()
+    results = run_workers(options)
+    elapsed = time.monotonic() - started
+    sys.exit(0 if report(options, results, elapsed) else 1)
+
+if __name__ == '__main__':
+    main()
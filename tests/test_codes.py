@@ -0,0 +1,84 @@
+"""
+Tests of the code name template filters and the resolvers behind them.
+
+    python test_codes.py
+"""
+import unittest
+from unittest import mock
+
+import testenv  # noqa: F401
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.template import Context, Template
+from django.test.utils import setup_databases, teardown_databases
+
+from commndata.fields import CodeField
+from commndata.models import CodeMaster
+from commndata.resolvers import CodeResolver, activate, deactivate
+from commndata.testing import create_codes
+
+old_config = None
+
+def setUpModule():
+    global old_config
+    old_config = setup_databases(verbosity=0, interactive=False)
+    create_codes('pref', {'%02d' % i: 'pref %d' % i for i in range(1, 48)})
+
+def tearDownModule():
+    teardown_databases(old_config, verbosity=0)
+
+class CodeNameFilterTest(unittest.TestCase):
+    template = Template('{% load codes %}{% for code in codes %}{{ code|codename:"pref" }},{% endfor %}')
+    codes = ['%02d' % (i % 47 + 1) for i in range(600)]
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self) -> list:
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            names = self.template.render(Context({'codes': self.codes})).split(',')[:-1]
+        self.lookups = get.call_count
+        return names
+
+    def test_without_active_resolver(self):
+        names = self.render()
+        self.assertEqual(names[:2], ['pref 1', 'pref 2'])
+        # The generation and the timeline: not a lookup per cell.
+        self.assertLessEqual(self.lookups, 3)
+
+        # The resolver of the thread is reused by the next rendering.
+        self.render()
+        self.assertEqual(self.lookups, 0)
+
+        # and discarded when the codes change.
+        CodeMaster.objects.filter(code='01').update(name='Hokkaido')
+        CodeMaster.objects.get(code='02').save()
+        self.assertEqual(self.render()[:2], ['Hokkaido', 'pref 2'])
+        self.assertLessEqual(self.lookups, 3)
+
+    def test_with_active_resolver(self):
+        activate(CodeResolver())
+        try:
+            names = self.render()
+        finally:
+            deactivate()
+        self.assertEqual(len(names), len(self.codes))
+        self.assertLessEqual(self.lookups, 2)
+
+class CodeFieldTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_validation_loads_the_category_once(self):
+        field = CodeField(category='pref')
+        field.set_attributes_from_name('pref')
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            for i in range(500):
+                field.clean('%02d' % (i % 47 + 1), None)
+        self.assertLessEqual(get.call_count, 3)
+        with self.assertRaises(ValidationError):
+            field.clean('99', None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tests of the seeded SQLite template database of commndata.testing.
+
+    python test_testing.py
+"""
+import datetime
+import os
+import shutil
+import sqlite3
+import unittest
+
+from testenv import WORK_DIR
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings, teardown_databases
+
+from commndata.models import CodeMaster
+from commndata.testing import create_codes, get_template_path, setup_template_databases
+
+def seed(using=None):
+    create_codes('pref', {'13': [(datetime.date(2000, 1, 1), 'Old Tokyo'), (datetime.date(2020, 1, 1), 'Tokyo')],
+                          '14': 'Kanagawa'}, using=using)
+
+def other_seed(using=None):
+    create_codes('pref', {'13': 'Tokyo'}, using=using)
+
+def count_codes(path: str) -> int:
+    database = sqlite3.connect(path)
+    try:
+        return database.execute('SELECT COUNT(*) FROM commndata_codemaster').fetchone()[0]
+    finally:
+        database.close()
+
+class TemplateDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        # A missing directory, created by the first build.
+        self.template_dir = os.path.join(WORK_DIR, 'templates')
+        self.override = override_settings(COMMNDATA_TEST_TEMPLATE_DIR=self.template_dir)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.template_dir, ignore_errors=True)
+
+    def setup_databases(self, parallel: int = 0):
+        old_config = setup_template_databases(['default'], seed, verbosity=0, parallel=parallel)
+        self.addCleanup(teardown_databases, old_config, verbosity=0, parallel=parallel)
+
+    def test_build_restore_and_clone(self):
+        path = get_template_path('default', seed)
+        self.assertFalse(os.path.exists(path))
+
+        self.setup_databases()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(count_codes(path), 3)
+        # Changes of the tests are not in the template.
+        CodeMaster.objects.filter(code='14').delete()
+        self.doCleanups()
+
+        built_at = os.path.getmtime(path)
+        self.setup_databases(parallel=2)
+        self.assertEqual(os.path.getmtime(path), built_at)
+        self.assertEqual(connection.settings_dict['NAME'], settings.DATABASES['default']['TEST']['NAME'])
+        self.assertEqual(list(CodeMaster.objects.order_by('code', 'start_date').values_list('code', 'name', 'end_date')), [
+            ('13', 'Old Tokyo', datetime.date(2019, 12, 31)),
+            ('13', 'Tokyo', None),
+            ('14', 'Kanagawa', None),
+        ])
+        for suffix in ('1', '2'):
+            clone = connection.creation.get_test_db_clone_settings(suffix)['NAME']
+            self.assertEqual(count_codes(clone), 3)
+
+    def test_template_path(self):
+        path = get_template_path('default', seed)
+        self.assertEqual(get_template_path('default', seed), path)
+        self.assertNotEqual(get_template_path('default', other_seed), path)
+        self.assertNotEqual(get_template_path('other', seed), path)
+        self.assertEqual(os.path.dirname(path), self.template_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+Settings of the tests in this directory, which run without a project:
+
+    python test_testing.py
+    python -m unittest discover -s tests
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+import django
+from django.conf import settings
+
+WORK_DIR = tempfile.mkdtemp(prefix='commndata_test_')
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+if not settings.configured:
+    settings.configure(
+        SECRET_KEY='test',
+        INSTALLED_APPS=[
+            'commndata',
+            'django.contrib.admin',
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.messages',
+            'django.contrib.sessions',
+        ],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(WORK_DIR, 'db.sqlite3'),
+                'TEST': {'NAME': os.path.join(WORK_DIR, 'test.sqlite3')},
+            },
+        },
+        TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'APP_DIRS': True}],
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        USE_TZ=True,
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+    )
+    django.setup()
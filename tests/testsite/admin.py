@@ -5,8 +5,8 @@ from django.contrib.auth import models as auth
 from django.utils.translation import gettext_lazy as _
 
 from checked_csv.admin import CsvExportModelMixin, CsvImportModelMixin
-from commndata.admin import UserAdminMixin, BaseTableAdminMixin, TimeLinedTableAdminMixin
-from commndata.models import CodeCategory, CodeMaster
+from commndata.admin import UserAdminMixin, BaseTableAdminMixin, TimeLinedTableAdminMixin, CodeMasterAdminMixin, CodeCategoryListFilter
+from commndata.models import CodeCategory, CodeMaster, CodeRelation
 
 admin.site.unregister(auth.User)
 admin.site.unregister(auth.Group)
@@ -22,15 +22,19 @@ class UserModelAdmin(UserAdminMixin, CsvExportModelMixin, CsvImportModelMixin, U
 
 class CodeCategoryModelAdmin(BaseTableAdminMixin, CsvExportModelMixin, CsvImportModelMixin, ModelAdmin):
     # import_field_names = ['codecategory', 'name']
-    pass
+    search_fields = ('codecategory', 'name')
 
 admin.site.register(CodeCategory, CodeCategoryModelAdmin)
 
 @admin.register(CodeMaster)
-class CodeMasterModelAdmin(TimeLinedTableAdminMixin, CsvExportModelMixin, CsvImportModelMixin, ModelAdmin):
+class CodeMasterModelAdmin(CodeMasterAdminMixin, CsvExportModelMixin, CsvImportModelMixin, ModelAdmin):
     list_display = ['name', 'code', 'display_order', 'codecategory','start_date', 'end_date']
-    list_filter = ['codecategory__name', 'start_date']
+    list_filter = [CodeCategoryListFilter, 'start_date']
     search_fields = ('codecategory__name', 'name')
     date_hierarchy = 'start_date'
 
-
+@admin.register(CodeRelation)
+class CodeRelationModelAdmin(TimeLinedTableAdminMixin, CsvExportModelMixin, CsvImportModelMixin, ModelAdmin):
+    list_display = ['parent_category', 'parent_code', 'child_category', 'child_code', 'start_date', 'end_date']
+    list_filter = ['start_date']
+    search_fields = ('parent_code', 'child_code')
@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'commndata.middleware.CodeResolverMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 